@@ -1,72 +1,194 @@
-from googleapiclient.errors import HttpError
-from agents.tools.token_handler import ensure_valid_token, get_sheets_service
+import logging
 
+from googleapiclient.errors import HttpError
+from agents.tools.client_pool import get_sheets_service
+from agents.tools.backends import backend_slot
+from agents.tools.singleflight import get_group
+from agents.accounting_agent.ledger_mirror import LedgerMirror
+from agents.accounting_agent.write_behind import (
+    DEAD_LETTER_PATH,
+    FLUSH_INTERVAL_SECONDS,
+    JOURNAL_PATH,
+    MAX_BATCH_SIZE,
+    WRITE_BEHIND_ENABLED,
+    WriteBehindQueue,
+)
 
 # Google Sheet 設置
 SPREADSHEET_ID = "13TmNPh4RsIPtZa7SqsQFkyi7vGxLgBhRSaOq34YedAI"  # 替換為實際的試算表 ID
 SHEET_NAME = "記帳"  # 替換為你的工作表名稱
 
+logger = logging.getLogger(__name__)
 
-def query_entries(parameters):
-    """查詢記帳條目"""
-    try:
-        ensure_valid_token()  # 確認 Token 是否有效
-        service = get_sheets_service()
-        range_ = f"{SHEET_NAME}!A:D"
+
+# 同時進行的整張工作表讀取只送出一次
+ledger_read_flight = get_group("sheets.ledger.read")
+
+
+def fetch_ledger_rows():
+    """讀取整張記帳工作表（供鏡像載入與對帳使用）"""
+    range_ = f"{SHEET_NAME}!A:D"
+    return ledger_read_flight.do(
+        (SPREADSHEET_ID, range_), lambda: _fetch_ledger_rows(range_)
+    )
+
+
+def _fetch_ledger_rows(range_):
+    service = get_sheets_service()
+    with backend_slot("sheets"):
         result = (
             service.spreadsheets()
             .values()
             .get(spreadsheetId=SPREADSHEET_ID, range=range_)
             .execute()
         )
-        rows = result.get("values", [])
+    return result.get("values", [])
+
 
-        # 過濾條目
+# 記帳工作表的本地鏡像，查詢不再每次下載整張表
+ledger_mirror = LedgerMirror(fetch_ledger_rows)
+
+
+def query_entries(parameters):
+    """查詢記帳條目"""
+    try:
         date_range = parameters.get("date_range", None)
         category = parameters.get("category", None)
-        filtered_rows = []
+        return ledger_mirror.query(date_range=date_range, category=category)
+    except HttpError as error:
+        return {"error": f"Google Sheets API Error: {error}"}
+    except Exception as e:
+        return {"error": f"Unexpected error: {str(e)}"}
 
-        for row in rows:
-            # 確保行數據完整
-            if len(row) < 2:
-                continue
 
-            # 移除空白字符
-            row_date = row[0].strip()
-            row_category = row[1].strip()
+def _flush_pending_rows(rows):
+    append_rows(get_sheets_service(), rows)
 
-            # 日期篩選
-            if date_range and not (date_range[0] <= row_date <= date_range[1]):
-                continue
 
-            # 分類篩選
-            if category and row_category != category:
-                continue
+def _is_retryable(error):
+    """429 與 5xx 等暫時性錯誤值得重試；其他 4xx 代表送出的資料本身有問題"""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        return status == 429 or status >= 500
+    return True
 
-            filtered_rows.append(row)
 
-        return filtered_rows
-    except HttpError as error:
-        return {"error": f"Google Sheets API Error: {error}"}
-    except Exception as e:
-        return {"error": f"Unexpected error: {str(e)}"}
+# 新增記帳的寫後佇列（ACCOUNTING_WRITE_BEHIND=1 時啟用）
+write_behind = WriteBehindQueue(
+    JOURNAL_PATH,
+    _flush_pending_rows,
+    FLUSH_INTERVAL_SECONDS,
+    MAX_BATCH_SIZE,
+    dead_letter_path=DEAD_LETTER_PATH,
+    retryable=_is_retryable,
+)
 
 
 def add_entry(parameters):
     """新增記帳條目"""
+    if WRITE_BEHIND_ENABLED:
+        # 先寫入本地日誌即回應，由背景批次寫入試算表
+        seq = write_behind.submit(_entry_row(parameters))
+        return {
+            "status": "accepted",
+            "message": "Entry queued for writing",
+            "journal_seq": seq,
+        }
     try:
-        ensure_valid_token()  # 確認 Token 是否有效
         service = get_sheets_service()
-        range_ = f"{SHEET_NAME}!A:D"
-        values = [
-            [
-                parameters.get("date"),
-                parameters.get("category"),
-                parameters.get("amount"),
-                parameters.get("description", ""),
-            ]
-        ]
-        body = {"values": values}
+        result = append_rows(service, [_entry_row(parameters)])
+        return {
+            "status": "success",
+            "updated_cells": result.get("updates", {}).get("updatedCells", 0),
+        }
+    except HttpError as error:
+        return {"error": f"Google Sheets API Error: {error}"}
+
+
+def _entry_row(parameters):
+    """將參數轉成試算表的一行"""
+    return [
+        parameters.get("date"),
+        parameters.get("category"),
+        parameters.get("amount"),
+        parameters.get("description", ""),
+    ]
+
+
+def _row_range(row_number):
+    return f"{SHEET_NAME}!A{row_number}:D{row_number}"
+
+
+def locate_rows(service, keys):
+    """找出多個 (日期, 分類) 所在的實體列號
+
+    先從鏡像索引取得列號，再用一次 batchGet 只讀回這些列確認內容；
+    若有不一致（工作表被其他人修改過），重新對帳一次後以鏡像結果為準。
+    """
+    if WRITE_BEHIND_ENABLED:
+        # 要修改的列可能還在寫後佇列中，先全部寫入試算表；
+        # 寫不進去時仍以鏡像為準，只影響尚在佇列中的列，不擋住其他修改
+        try:
+            write_behind.flush_now()
+        except Exception as e:
+            logger.warning(f"修改前寫入寫後佇列失敗: {e}")
+    located = {key: ledger_mirror.find_row(*key) for key in keys}
+    candidates = sorted({n for n in located.values() if n is not None})
+    if not candidates:
+        return located
+
+    with backend_slot("sheets"):
+        result = (
+            service.spreadsheets()
+            .values()
+            .batchGet(
+                spreadsheetId=SPREADSHEET_ID,
+                ranges=[_row_range(n) for n in candidates],
+            )
+            .execute()
+        )
+    actual = {}
+    for n, value_range in zip(candidates, result.get("valueRanges", [])):
+        values = value_range.get("values", [])
+        row = values[0] if values else []
+        actual[n] = (
+            (str(row[0]).strip(), str(row[1]).strip()) if len(row) >= 2 else None
+        )
+
+    if any(n is not None and actual.get(n) != key for key, n in located.items()):
+        ledger_mirror.reconcile()
+        located = {key: ledger_mirror.find_row(*key) for key in keys}
+    return located
+
+
+def write_rows(service, rows_by_number):
+    """以一次 values().batchUpdate 只寫入指定的列"""
+    if not rows_by_number:
+        return {}
+    body = {
+        "valueInputOption": "RAW",
+        "data": [
+            {"range": _row_range(n), "values": [row]}
+            for n, row in sorted(rows_by_number.items())
+        ],
+    }
+    with backend_slot("sheets"):
+        result = (
+            service.spreadsheets()
+            .values()
+            .batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body)
+            .execute()
+        )
+    for n, row in rows_by_number.items():
+        ledger_mirror.apply_update(n, row)
+    return result
+
+
+def append_rows(service, rows):
+    """以一次 values().append 新增多列"""
+    range_ = f"{SHEET_NAME}!A:D"
+    body = {"values": rows}
+    with backend_slot("sheets"):
         result = (
             service.spreadsheets()
             .values()
@@ -78,54 +200,108 @@ def add_entry(parameters):
             )
             .execute()
         )
-        return {
-            "status": "success",
-            "updated_cells": result.get("updates", {}).get("updatedCells", 0),
+    ledger_mirror.apply_append(rows, result.get("updates", {}).get("updatedRange"))
+    return result
+
+
+def _delete_requests(row_numbers):
+    """由下往上的 deleteDimension 請求，前面的刪除不會讓後面的列號位移"""
+    return [
+        {
+            "deleteDimension": {
+                "range": {
+                    "sheetId": 0,  # 工作表 ID（通常默認為 0，若不是請根據情況調整）
+                    "dimension": "ROWS",
+                    "startIndex": n - 1,  # 刪除起始索引（0 基）
+                    "endIndex": n,  # 刪除結束索引（不含）
+                }
+            }
         }
-    except HttpError as error:
-        return {"error": f"Google Sheets API Error: {error}"}
+        for n in sorted(set(row_numbers), reverse=True)
+    ]
 
 
-def update_entry(parameters):
-    """更新記帳條目"""
-    try:
-        ensure_valid_token()  # 確認 Token 是否有效
-        service = get_sheets_service()
-        range_ = f"{SHEET_NAME}!A:D"
+def _cell_value(value):
+    """對應 valueInputOption=RAW：數字存成數字，其他值存成字串，None 清空儲存格"""
+    if value is None:
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+def _update_requests(rows_by_number):
+    """以 updateCells 改寫指定的列（A:D）"""
+    return [
+        {
+            "updateCells": {
+                "range": {
+                    "sheetId": 0,
+                    "startRowIndex": n - 1,
+                    "endRowIndex": n,
+                    "startColumnIndex": 0,
+                    "endColumnIndex": 4,
+                },
+                "rows": [{"values": [_cell_value(value) for value in row]}],
+                "fields": "userEnteredValue",
+            }
+        }
+        for n, row in sorted(rows_by_number.items())
+    ]
+
+
+def delete_rows(service, row_numbers):
+    """以一次 batchUpdate 刪除多列，由下往上刪除以免前面的刪除讓後面的列號位移"""
+    return modify_rows(service, {}, row_numbers)
+
+
+def modify_rows(service, rows_by_number, row_numbers):
+    """以一次 spreadsheets().batchUpdate 先改寫、再由下往上刪除多列
+
+    同一個 batchUpdate 中的請求依序且整批套用，改寫使用的是刪除前的列號。
+    """
+    requests = _update_requests(rows_by_number) + _delete_requests(row_numbers)
+    if not requests:
+        return {}
+    with backend_slot("sheets"):
         result = (
             service.spreadsheets()
-            .values()
-            .get(spreadsheetId=SPREADSHEET_ID, range=range_)
+            .batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"requests": requests})
             .execute()
         )
-        rows = result.get("values", [])
-
-        updated = False
-        for i, row in enumerate(rows):
-            if row[0] == parameters.get("date") and row[1] == parameters.get(
-                "category"
-            ):
-                rows[i] = [
-                    parameters.get("date"),
-                    parameters.get("category"),
-                    parameters.get("amount"),
-                    parameters.get("description", ""),
-                ]
-                updated = True
-                break
-
-        if not updated:
-            return {"error": "Entry not found for update"}
-
-        body = {"values": rows}
-        service.spreadsheets().values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range=range_,
-            valueInputOption="RAW",
-            body=body,
-        ).execute()
-
-        return {"status": "success", "message": "Entry updated successfully"}
+    for n, row in rows_by_number.items():
+        ledger_mirror.apply_update(n, row)
+    if row_numbers:
+        ledger_mirror.apply_delete(sorted(set(row_numbers), reverse=True))
+    return result
+
+
+def update_entries(entries):
+    """批次更新多筆記帳條目，每筆只改寫所在的那一列"""
+    service = get_sheets_service()
+    keys = [(entry.get("date"), entry.get("category")) for entry in entries]
+    located = locate_rows(service, keys)
+
+    rows_by_number = {}
+    results = []
+    for key, entry in zip(keys, entries):
+        row_number = located.get(key)
+        if row_number is None:
+            results.append({"error": "Entry not found for update"})
+            continue
+        rows_by_number[row_number] = _entry_row(entry)
+        results.append({"status": "success", "message": "Entry updated successfully"})
+
+    write_rows(service, rows_by_number)
+    return results
+
+
+def update_entry(parameters):
+    """更新記帳條目"""
+    try:
+        return update_entries([parameters])[0]
     except HttpError as error:
         return {"error": f"Google Sheets API Error: {error}"}
 
@@ -133,58 +309,14 @@ def update_entry(parameters):
 def delete_entry(parameters):
     """刪除指定記帳條目整行"""
     try:
-        ensure_valid_token()  # 確認 Token 是否有效
         service = get_sheets_service()
-        range_ = f"{SHEET_NAME}!A:D"
-        result = (
-            service.spreadsheets()
-            .values()
-            .get(spreadsheetId=SPREADSHEET_ID, range=range_)
-            .execute()
-        )
-        rows = result.get("values", [])
-
-        entry_found = False
-        row_index_to_delete = None
-
-        for i, row in enumerate(rows):
-            # 確保行數據完整
-            if len(row) < 2:
-                continue
-
-            # 移除空白字符並進行匹配
-            row_date = row[0].strip()
-            row_category = row[1].strip()
-            if row_date == parameters.get("date") and row_category == parameters.get(
-                "category"
-            ):
-                entry_found = True
-                row_index_to_delete = i + 1  # Google Sheets 的行索引從 1 開始
-                break
-
-        if not entry_found:
+        key = (parameters.get("date"), parameters.get("category"))
+        row_index_to_delete = locate_rows(service, [key])[key]
+
+        if row_index_to_delete is None:
             return {"error": "Entry not found for deletion"}
 
-        # 使用 batchUpdate 刪除整行
-        request_body = {
-            "requests": [
-                {
-                    "deleteDimension": {
-                        "range": {
-                            "sheetId": 0,  # 工作表 ID（通常默認為 0，若不是請根據情況調整）
-                            "dimension": "ROWS",
-                            "startIndex": row_index_to_delete
-                            - 1,  # 刪除起始索引（0 基）
-                            "endIndex": row_index_to_delete,  # 刪除結束索引（不含）
-                        }
-                    }
-                }
-            ]
-        }
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=SPREADSHEET_ID,
-            body=request_body,
-        ).execute()
+        delete_rows(service, [row_index_to_delete])
 
         return {"status": "success", "message": "Row deleted successfully"}
     except HttpError as error:
@@ -193,6 +325,112 @@ def delete_entry(parameters):
         return {"error": f"Unexpected error: {str(e)}"}
 
 
+def bulk_entries(parameters):
+    """批次套用多筆新增 / 更新 / 刪除
+
+    參數格式: {"operations": [{"command": "add", "parameters": {...}}, ...]}
+    所有更新與刪除合併成一次 spreadsheets().batchUpdate（先改寫，再由下往上刪除），
+    所有新增合併成一次 append，結果依原順序逐筆回報。
+    更新與刪除前另有一次 batchGet，只讀回要修改的列確認鏡像的列號沒有過時。
+    """
+    operations = parameters.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return {"error": "operations is required for bulk command"}
+
+    results = [None] * len(operations)
+    adds, updates, deletes = [], [], []
+    seen_keys = set()
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not isinstance(
+            operation.get("parameters", {}), dict
+        ):
+            results[i] = {"error": "Invalid operation: expected an object"}
+            continue
+        command = operation.get("command")
+        entry = operation.get("parameters", {})
+        if command == "add":
+            adds.append(i)
+            continue
+        if command not in ("update", "delete"):
+            results[i] = {"error": "Unknown command"}
+            continue
+        key = (entry.get("date"), entry.get("category"))
+        if key in seen_keys:
+            results[i] = {"error": "Duplicate entry in bulk operations"}
+            continue
+        seen_keys.add(key)
+        (updates if command == "update" else deletes).append(i)
+
+    service = get_sheets_service()
+
+    def entry(i):
+        return operations[i].get("parameters", {})
+
+    def entry_key(i):
+        return entry(i).get("date"), entry(i).get("category")
+
+    try:
+        located = locate_rows(service, [entry_key(i) for i in updates + deletes])
+    except Exception as error:
+        for i in updates + deletes:
+            results[i] = _sheets_error(error)
+        updates, deletes, located = [], [], {}
+
+    outcomes, rows_by_number, row_numbers = {}, {}, []
+    for i in updates:
+        row_number = located.get(entry_key(i))
+        if row_number is None:
+            results[i] = {"error": "Entry not found for update"}
+        else:
+            rows_by_number[row_number] = _entry_row(entry(i))
+            outcomes[i] = {"status": "success", "message": "Entry updated successfully"}
+    for i in deletes:
+        row_number = located.get(entry_key(i))
+        if row_number is None:
+            results[i] = {"error": "Entry not found for deletion"}
+        else:
+            row_numbers.append(row_number)
+            outcomes[i] = {"status": "success", "message": "Row deleted successfully"}
+    _run_group(
+        results, outcomes, lambda: modify_rows(service, rows_by_number, row_numbers)
+    )
+
+    _run_group(
+        results,
+        {i: {"status": "success", "message": "Entry added successfully"} for i in adds},
+        lambda: append_rows(service, [_entry_row(entry(i)) for i in adds]),
+    )
+
+    succeeded = sum(1 for result in results if "error" not in result)
+    return {
+        "status": "success" if succeeded == len(results) else "partial",
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+    }
+
+
+def _run_group(results, outcomes, call):
+    """執行一次批次呼叫，成功時填入各操作的結果（outcomes: 索引 -> 成功結果）
+
+    任何例外（名額逾時、連線逾時等）都只記在這一組，之前已完成的組仍回報成功。
+    """
+    if not outcomes:
+        return
+    try:
+        call()
+    except Exception as error:
+        outcomes = {i: _sheets_error(error) for i in outcomes}
+    for i, outcome in outcomes.items():
+        results[i] = dict(outcome)
+
+
+def _sheets_error(error):
+    if isinstance(error, HttpError):
+        return {"error": f"Google Sheets API Error: {error}"}
+    return {"error": f"Google Sheets request failed: {type(error).__name__}: {error}"}
+
+
 def handle_command(command, parameters):
     """根據命令執行相應操作"""
     if command == "query":
@@ -203,5 +441,25 @@ def handle_command(command, parameters):
         return update_entry(parameters)
     elif command == "delete":
         return delete_entry(parameters)
+    elif command == "bulk":
+        return bulk_entries(parameters)
     else:
         return {"error": "Unknown command"}
+
+
+def start_agent():
+    if WRITE_BEHIND_ENABLED:
+        # 重放上次未寫入試算表的記帳條目
+        write_behind.start()
+
+
+def stop_agent():
+    if WRITE_BEHIND_ENABLED:
+        write_behind.stop()
+
+
+def agent_stats():
+    return {
+        "ledger_mirror": ledger_mirror.stats(),
+        "ledger_write_behind": write_behind.stats(),
+    }
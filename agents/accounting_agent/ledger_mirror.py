@@ -0,0 +1,330 @@
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# 與試算表對帳的間隔（秒）
+RECONCILE_INTERVAL_SECONDS = int(os.getenv("LEDGER_RECONCILE_INTERVAL", "300"))
+# 設定後會把最近一次對帳結果存入 SQLite，重啟時先用快照回應再於背景對帳
+LEDGER_SNAPSHOT_PATH = os.getenv("LEDGER_SNAPSHOT_PATH")
+
+logger = logging.getLogger(__name__)
+
+
+def _key(row):
+    """返回 (日期, 分類)，資料不完整的行返回 None"""
+    if len(row) < 2:
+        return None
+    return str(row[0]).strip(), str(row[1]).strip()
+
+
+def _cell(value):
+    """轉成試算表 API 讀回的格式：數字與其他值都是字串，空值為空字串"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def normalize_row(row):
+    """讓 write-through 的行與對帳讀回的行格式一致（API 不返回結尾的空白儲存格）"""
+    cells = [_cell(value) for value in row]
+    while cells and cells[-1] == "":
+        cells.pop()
+    return cells
+
+
+class LedgerMirror:
+    """記帳工作表的本地鏡像
+
+    - 以列號保存每一行（第 n 行存在 rows[n - 1]），與試算表的實體列號一致
+    - 依日期排序的索引，範圍查詢為 O(log n + k)
+    - (日期, 分類) 與分類的雜湊索引
+    自己的新增 / 更新 / 刪除會直接寫入鏡像，並定期與試算表重新對帳。
+    """
+
+    def __init__(
+        self,
+        fetch_rows,
+        reconcile_interval=RECONCILE_INTERVAL_SECONDS,
+        snapshot_path=LEDGER_SNAPSHOT_PATH,
+    ):
+        self._fetch_rows = fetch_rows
+        self.reconcile_interval = reconcile_interval
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        # 只讓一個執行緒載入 / 對帳；讀取試算表時不持有 _lock，寫入與查詢不會被擋住
+        self._load_lock = threading.Lock()
+        # 每次寫入鏡像都遞增，對帳期間有變動時丟棄讀到的內容
+        self._generation = 0
+        self._rows = []
+        self._dates = []  # [(日期, 列號)]，依日期排序
+        self._by_key = {}  # (日期, 分類) -> [列號]
+        self._by_category = {}  # 分類 -> [列號]
+        self._loaded = False
+        self._stale = False
+        self._pending = {}  # 起始列號 -> 尚未接上的新增（並行新增的回應順序可能顛倒）
+        self._reconciled_at = 0.0
+        # 對帳失敗或衝突後，這個時間之前不再對帳（背景與查詢路徑都是）
+        self._retry_at = 0.0
+        self._thread = None
+        self._stats = {
+            "reconciles": 0,
+            "reconcile_failures": 0,
+            "reconcile_conflicts": 0,
+            "queries": 0,
+        }
+
+    # ---- 載入與對帳 ----
+
+    def replace(self, rows):
+        """以試算表的完整內容取代鏡像並重建索引"""
+        with self._lock:
+            self._generation += 1
+            self._rows = [list(row) for row in rows]
+            self._rebuild_indexes()
+            self._loaded = True
+            self._stale = False
+            self._pending = {}
+            self._reconciled_at = time.time()
+
+    def reconcile(self):
+        """重新讀取整張工作表並取代鏡像；讀取期間鏡像有寫入時返回 False
+
+        讀取不持有鎖。期間完成的新增 / 更新 / 刪除不一定包含在讀到的內容中，
+        因此丟棄這次結果；鏡像已包含這些寫入，由背景執行緒稍後再對帳。
+        """
+        with self._lock:
+            generation = self._generation
+        try:
+            rows = self._fetch_rows()
+        except Exception:
+            with self._lock:
+                self._stats["reconcile_failures"] += 1
+                self._retry_at = time.time() + self._retry_delay()
+            raise
+        with self._lock:
+            if self._generation != generation:
+                self._stats["reconcile_conflicts"] += 1
+                self._retry_at = time.time() + self._retry_delay()
+                return False
+            self.replace(rows)
+            self._stats["reconciles"] += 1
+        self._save_snapshot(rows)
+        return True
+
+    def _retry_delay(self):
+        return min(self.reconcile_interval, 60)
+
+    def ensure_loaded(self, attempts=3):
+        """第一次使用時載入鏡像（優先使用快照），並啟動背景對帳執行緒"""
+        if self._loaded and not self._stale and not self._pending:
+            return
+        if self._loaded and time.time() < self._retry_at:
+            # 剛對帳失敗或衝突，先以目前的鏡像回應
+            return
+        with self._load_lock:
+            for _ in range(attempts):
+                with self._lock:
+                    # 有新增尚未接上時，中間缺的列是別人寫入的，需要重新讀取
+                    outdated = self._stale or bool(self._pending)
+                    loaded = self._loaded
+                if loaded and not outdated:
+                    return
+                if not loaded:
+                    snapshot = self._load_snapshot()
+                    if snapshot is not None:
+                        self.replace(snapshot)
+                        # 快照可能已過時，讓背景執行緒立即對帳
+                        self._reconciled_at = 0.0
+                        self._start_background()
+                        return
+                if self.reconcile():
+                    self._start_background()
+                    return
+                if loaded:
+                    # 已有資料時不在查詢路徑上反覆下載整張表
+                    break
+            # 寫入持續進行時，先以目前的鏡像回應，之後再由背景執行緒對帳
+            self._start_background()
+
+    def _start_background(self):
+        if self._thread is not None or self.reconcile_interval <= 0:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="ledger-reconcile", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            # 失敗或讀取期間有寫入時延後重試，寫入持續進行時不會不斷下載整張表
+            due = max(self._reconciled_at + self.reconcile_interval, self._retry_at)
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                with self._load_lock:
+                    self.reconcile()
+            except Exception as e:
+                logger.error(f"記帳鏡像對帳失敗: {e}")
+
+    def _rebuild_indexes(self):
+        self._dates = []
+        self._by_key = {}
+        self._by_category = {}
+        for i, row in enumerate(self._rows):
+            self._index_row(i + 1, row, keep_sorted=False)
+        self._dates.sort()
+
+    def _index_row(self, row_number, row, keep_sorted=True):
+        key = _key(row)
+        if key is None:
+            return
+        if keep_sorted:
+            bisect.insort(self._dates, (key[0], row_number))
+        else:
+            self._dates.append((key[0], row_number))
+        bisect.insort(self._by_key.setdefault(key, []), row_number)
+        bisect.insort(self._by_category.setdefault(key[1], []), row_number)
+
+    def _unindex_row(self, row_number, row):
+        key = _key(row)
+        if key is None:
+            return
+        i = bisect.bisect_left(self._dates, (key[0], row_number))
+        if i < len(self._dates) and self._dates[i] == (key[0], row_number):
+            del self._dates[i]
+        for index, value in ((self._by_key, key), (self._by_category, key[1])):
+            numbers = index.get(value, [])
+            if row_number in numbers:
+                numbers.remove(row_number)
+            if not numbers:
+                index.pop(value, None)
+
+    # ---- 讀取 ----
+
+    def query(self, date_range=None, category=None):
+        """依日期範圍與分類篩選，按試算表順序返回符合的行"""
+        self.ensure_loaded()
+        with self._lock:
+            self._stats["queries"] += 1
+            if date_range:
+                lo = bisect.bisect_left(self._dates, (date_range[0],))
+                hi = bisect.bisect_right(self._dates, (date_range[1], float("inf")))
+                numbers = [number for _, number in self._dates[lo:hi]]
+                if category:
+                    numbers = [
+                        n for n in numbers if _key(self._rows[n - 1])[1] == category
+                    ]
+                numbers.sort()
+            elif category:
+                numbers = self._by_category.get(category, [])
+            else:
+                numbers = [n for n, row in enumerate(self._rows, 1) if _key(row)]
+            return [list(self._rows[n - 1]) for n in numbers]
+
+    def find_row(self, date, category):
+        """返回第一筆符合 (日期, 分類) 的列號，找不到返回 None"""
+        self.ensure_loaded()
+        with self._lock:
+            numbers = self._by_key.get((date, category))
+            return numbers[0] if numbers else None
+
+    # ---- 寫入（write-through）----
+
+    def apply_append(self, rows, updated_range=None):
+        """新增多行；updated_range 為 API 回傳的實際寫入範圍，例如 記帳!A12:D13"""
+        with self._lock:
+            self._generation += 1
+            if not self._loaded:
+                return
+            start = _row_from_range(updated_range)
+            if start is None or start < len(self._rows) + 1 or start in self._pending:
+                # 寫入位置與鏡像不一致，代表工作表已被其他人修改，下次讀取前先對帳
+                self._stale = True
+                return
+            # 並行新增時較晚寫入的回應可能先回來，先暫存，等前面的列接上再套用
+            self._pending[start] = [normalize_row(row) for row in rows]
+            while len(self._rows) + 1 in self._pending:
+                for row in self._pending.pop(len(self._rows) + 1):
+                    self._rows.append(row)
+                    self._index_row(len(self._rows), row)
+
+    def apply_update(self, row_number, row):
+        with self._lock:
+            self._generation += 1
+            if not self._loaded or not 1 <= row_number <= len(self._rows):
+                return
+            row = normalize_row(row)
+            self._unindex_row(row_number, self._rows[row_number - 1])
+            self._rows[row_number - 1] = row
+            self._index_row(row_number, row)
+
+    def apply_delete(self, row_numbers):
+        """刪除多行，之後的列號都會往前移，因此由下往上刪除後重建一次索引"""
+        with self._lock:
+            self._generation += 1
+            if not self._loaded:
+                return
+            for n in sorted(set(row_numbers), reverse=True):
+                if 1 <= n <= len(self._rows):
+                    del self._rows[n - 1]
+            self._rebuild_indexes()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["rows"] = len(self._rows)
+            stats["loaded"] = self._loaded
+            stats["seconds_since_reconcile"] = (
+                time.time() - self._reconciled_at if self._loaded else None
+            )
+        return stats
+
+    # ---- SQLite 快照（選用）----
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with sqlite3.connect(self.snapshot_path) as conn:
+                cursor = conn.execute("SELECT raw FROM ledger ORDER BY row_number")
+                return [json.loads(raw) for (raw,) in cursor]
+        except sqlite3.Error as e:
+            logger.warning(f"讀取記帳快照失敗: {e}")
+            return None
+
+    def _save_snapshot(self, rows):
+        if not self.snapshot_path:
+            return
+        try:
+            with sqlite3.connect(self.snapshot_path) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS ledger "
+                    "(row_number INTEGER PRIMARY KEY, raw TEXT NOT NULL)"
+                )
+                conn.execute("DELETE FROM ledger")
+                conn.executemany(
+                    "INSERT INTO ledger (row_number, raw) VALUES (?, ?)",
+                    [
+                        (i, json.dumps(row, ensure_ascii=False))
+                        for i, row in enumerate(rows, 1)
+                    ],
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"寫入記帳快照失敗: {e}")
+
+
+def _row_from_range(updated_range):
+    """從 記帳!A12:D12 取出列號 12"""
+    if not updated_range:
+        return None
+    cell = updated_range.split("!")[-1].split(":")[0]
+    digits = "".join(ch for ch in cell if ch.isdigit())
+    return int(digits) if digits else None
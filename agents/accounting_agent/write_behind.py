@@ -0,0 +1,271 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# 設為 1 時新增記帳會先寫入本地日誌並立即回應，再由背景批次寫入試算表
+WRITE_BEHIND_ENABLED = os.getenv("ACCOUNTING_WRITE_BEHIND", "0") == "1"
+JOURNAL_PATH = os.getenv("ACCOUNTING_JOURNAL_PATH", "accounting_journal.jsonl")
+# 最舊的待寫入條目最多等待幾秒就送出
+FLUSH_INTERVAL_SECONDS = float(os.getenv("ACCOUNTING_FLUSH_INTERVAL", "2"))
+# 單次 append 最多包含幾筆
+MAX_BATCH_SIZE = int(os.getenv("ACCOUNTING_FLUSH_BATCH", "100"))
+# 寫入失敗後的重試間隔（秒）
+RETRY_INTERVAL_SECONDS = float(os.getenv("ACCOUNTING_FLUSH_RETRY", "5"))
+# 無法重試的錯誤（例如 400）連續失敗幾次後移到死信日誌；可重試的錯誤會一直重試
+MAX_FLUSH_ATTEMPTS = int(os.getenv("ACCOUNTING_FLUSH_ATTEMPTS", "5"))
+DEAD_LETTER_PATH = os.getenv(
+    "ACCOUNTING_DEAD_LETTER_PATH", "accounting_dead_letter.jsonl"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """記帳新增的寫後佇列
+
+    每筆條目先以 JSON Lines 追加到日誌檔並 fsync，之後才回應使用者；
+    背景執行緒依時間或數量把待寫入條目合併成一次 append。
+    成功寫入後在日誌追加 flushed 標記，重啟時重放標記之後的條目。
+    若程序在 append 成功但標記寫入前中止，重放會造成重複（至少一次語意）。
+
+    批次因無法重試的錯誤失敗時改為逐筆送出，找出有問題的那一列；
+    該列連續失敗 max_attempts 次後移到死信日誌，不再擋住後面的條目。
+    """
+
+    def __init__(
+        self,
+        journal_path,
+        flush_rows,
+        flush_interval,
+        max_batch,
+        dead_letter_path=DEAD_LETTER_PATH,
+        retryable=None,
+        max_attempts=MAX_FLUSH_ATTEMPTS,
+    ):
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path
+        self._flush_rows = flush_rows
+        # retryable(error) 返回 False 表示錯誤出在資料本身，重試也不會成功
+        self._retryable = retryable or (lambda error: True)
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        # 同一時間只允許一個批次寫入，避免背景執行緒與 flush_now 重複送出
+        self._flush_lock = threading.Lock()
+        self._pending = []  # [(序號, 列, 接受時間)]
+        self._seq = 0
+        self._isolate_seq = 0  # 序號不超過此值的條目逐筆送出
+        self._attempts = 0  # 佇列最前面那一列連續無法重試的失敗次數
+        self._journal = None
+        self._thread = None
+        self._stopping = False
+        self._stats = {
+            "accepted": 0,
+            "flushed": 0,
+            "batches": 0,
+            "flush_failures": 0,
+            "dead_lettered": 0,
+            "replayed": 0,
+            "last_batch_size": 0,
+            "last_flush_seconds": 0.0,
+        }
+
+    def start(self):
+        """重放日誌中尚未寫入的條目並啟動背景寫入執行緒"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._replay()
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="ledger-write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, flush=True):
+        """停止背景執行緒，預設先把待寫入條目全部送出"""
+        if flush:
+            try:
+                self.flush_now()
+            except Exception as e:
+                logger.error(f"停止前寫入失敗，條目保留在日誌中待下次重放: {e}")
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def submit(self, row):
+        """把一列寫入日誌並排入佇列，返回其序號"""
+        self.start()
+        with self._cond:
+            self._seq += 1
+            self._write_record({"type": "entry", "seq": self._seq, "row": row})
+            self._pending.append((self._seq, row, time.time()))
+            self._stats["accepted"] += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def flush_now(self):
+        """立即同步送出所有待寫入條目（更新或刪除前呼叫，確保試算表已包含這些列）"""
+        while self._flush_next():
+            pass
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._batch_ready():
+                    self._cond.wait(self._wait_time())
+                if self._stopping:
+                    return
+            try:
+                self._flush_next()
+            except Exception as e:
+                logger.error(f"記帳批次寫入失敗，稍後重試: {e}")
+                time.sleep(RETRY_INTERVAL_SECONDS)
+
+    def _batch_ready(self):
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.max_batch:
+            return True
+        return time.time() - self._pending[0][2] >= self.flush_interval
+
+    def _wait_time(self):
+        if not self._pending:
+            return None
+        return max(0.0, self._pending[0][2] + self.flush_interval - time.time())
+
+    def _flush_next(self):
+        """送出下一批待寫入條目，沒有條目時返回 False
+
+        可重試的錯誤直接拋出；無法重試的錯誤會拆成逐筆送出，
+        單筆失敗達上限時移到死信日誌，兩者都視為有進展並返回 True。
+        """
+        with self._flush_lock:
+            with self._cond:
+                size = self.max_batch
+                if self._pending and self._pending[0][0] <= self._isolate_seq:
+                    size = 1
+                batch = self._pending[:size]
+            if not batch:
+                return False
+            try:
+                self._flush(batch)
+            except Exception as error:
+                with self._cond:
+                    self._stats["flush_failures"] += 1
+                    if self._retryable(error):
+                        raise
+                    if len(batch) > 1:
+                        logger.warning(f"記帳批次無法寫入，改為逐筆送出: {error}")
+                        self._isolate_seq = batch[-1][0]
+                        return True
+                    self._attempts += 1
+                    if self._attempts < self.max_attempts:
+                        raise
+                    self._dead_letter(batch[0], error)
+            return True
+
+    def _dead_letter(self, item, error):
+        seq, row, accepted_at = item
+        logger.error(f"記帳條目 {seq} 無法寫入試算表，移到死信日誌: {error}")
+        record = {
+            "seq": seq,
+            "row": row,
+            "accepted_at": accepted_at,
+            "error": str(error),
+            "failed_at": time.time(),
+        }
+        with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letters:
+            dead_letters.write(json.dumps(record, ensure_ascii=False) + "\n")
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+        # 死信一定是佇列最前面的條目，標記後重放時會略過
+        self._write_record({"type": "dead", "seq": seq})
+        self._pending = [entry for entry in self._pending if entry[0] > seq]
+        self._attempts = 0
+        self._stats["dead_lettered"] += 1
+        if not self._pending:
+            self._compact()
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        self._flush_rows([row for _, row, _ in batch])
+        elapsed = time.perf_counter() - started
+
+        with self._cond:
+            last_seq = batch[-1][0]
+            self._attempts = 0
+            self._write_record({"type": "flushed", "seq": last_seq})
+            self._pending = [item for item in self._pending if item[0] > last_seq]
+            self._stats["flushed"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_flush_seconds"] = elapsed
+            if not self._pending:
+                self._compact()
+
+    def _write_record(self, record):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _replay(self):
+        """讀取日誌，把最後一個 flushed / dead 標記之後的條目放回佇列"""
+        if not os.path.exists(self.journal_path):
+            return
+        entries, flushed_seq = [], 0
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 最後一行可能在寫入途中中斷，略過即可
+                    continue
+                if record.get("type") == "entry":
+                    entries.append(record)
+                elif record.get("type") in ("flushed", "dead"):
+                    flushed_seq = max(flushed_seq, record["seq"])
+
+        now = time.time()
+        self._pending = [
+            (record["seq"], record["row"], now)
+            for record in entries
+            if record["seq"] > flushed_seq
+        ]
+        self._seq = max([flushed_seq] + [record["seq"] for record in entries])
+        self._stats["replayed"] += len(self._pending)
+        if self._pending:
+            logger.info(f"重放 {len(self._pending)} 筆尚未寫入試算表的記帳條目")
+
+    def _compact(self):
+        """佇列清空時截斷日誌，只保留目前的序號"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as journal:
+            journal.write(json.dumps({"type": "flushed", "seq": self._seq}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
@@ -0,0 +1,256 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+from agents.calendar_agent.interval_index import IntervalIndex
+
+# 設為 0 時停用本地事件快取，每次查詢都直接呼叫 events().list
+EVENT_CACHE_ENABLED = os.getenv("CALENDAR_EVENT_CACHE", "1") == "1"
+# 讀取時距離上次同步超過幾秒才以 syncToken 拉取增量
+SYNC_INTERVAL_SECONDS = float(os.getenv("CALENDAR_SYNC_INTERVAL", "30"))
+# events().list 每頁的事件數（maxResults，API 上限 2500）
+PAGE_SIZE = int(os.getenv("CALENDAR_PAGE_SIZE", "250"))
+DEFAULT_TIMEZONE = "Asia/Taipei"
+
+logger = logging.getLogger(__name__)
+
+
+def to_timestamp(value, timezone=DEFAULT_TIMEZONE):
+    """將 RFC 3339 時間或 YYYY-MM-DD 日期轉成 epoch 秒數，未帶時區時視為台北時間"""
+    if "T" not in value:
+        parsed = datetime.strptime(value, "%Y-%m-%d")
+    else:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=ZoneInfo(timezone))
+    return parsed.timestamp()
+
+
+def event_bounds(event):
+    """返回事件的 (開始, 結束) epoch 秒數；全天事件以 date 欄位計算"""
+    start, end = event.get("start", {}), event.get("end", {})
+    start_value = start.get("dateTime") or start.get("date")
+    end_value = end.get("dateTime") or end.get("date") or start_value
+    return (
+        to_timestamp(start_value, start.get("timeZone", DEFAULT_TIMEZONE)),
+        to_timestamp(end_value, end.get("timeZone", DEFAULT_TIMEZONE)),
+    )
+
+
+class EventStore:
+    """primary 日曆的本地事件快取
+
+    第一次使用時做一次完整同步並取得 nextSyncToken，之後只以 syncToken 拉取增量；
+    自己的新增 / 更新 / 刪除則直接寫入快取。範圍、時間點與重疊查詢都透過
+    區間索引在本地完成，另外維護標題 -> 事件 ID 的對照表。
+    同步時在鎖外下載，只在套用結果時持有鎖，查詢與寫入不會等待網路。
+    """
+
+    def __init__(self, list_events, sync_interval=SYNC_INTERVAL_SECONDS):
+        # list_events(**kwargs) 執行一次 events().list 並返回回應內容
+        self._list_events = list_events
+        self.sync_interval = sync_interval
+        self._lock = threading.RLock()
+        # 同一時間只有一個同步；下載期間不持有 _lock，查詢與寫入不必等待網路
+        self._sync_lock = threading.Lock()
+        self._events = {}  # event_id -> event
+        self._by_summary = {}  # summary -> {event_id}
+        self._index = None  # 完整同步後設為 None，下次查詢時重建
+        self._sync_token = None
+        self._synced_at = 0.0
+        # 每次自己寫入快取都遞增；下載期間有寫入時丟棄下載結果，避免以舊資料覆蓋
+        self._generation = 0
+        self._stats = {
+            "full_syncs": 0,
+            "incremental_syncs": 0,
+            "delta_events": 0,
+            "sync_conflicts": 0,
+            "queries": 0,
+        }
+
+    def _pages(self, **params):
+        """依 nextPageToken 取得所有頁面，返回 (事件列表, nextSyncToken)"""
+        items, page_token = [], None
+        while True:
+            response = self._list_events(
+                maxResults=PAGE_SIZE, pageToken=page_token, **params
+            )
+            items.extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return items, response.get("nextSyncToken")
+
+    def full_sync(self):
+        """完整同步：重新下載所有事件並取代快取；下載期間有自己的寫入時不套用並返回 False"""
+        with self._sync_lock:
+            return self._full_sync()
+
+    def _full_sync(self):
+        with self._lock:
+            generation = self._generation
+        items, sync_token = self._pages(singleEvents=True)
+        with self._lock:
+            if self._generation != generation:
+                self._stats["sync_conflicts"] += 1
+                return False
+            self._events = {}
+            self._by_summary = {}
+            self._index = None
+            for event in items:
+                if event.get("status") != "cancelled":
+                    self._put(event)
+            self._sync_token = sync_token
+            self._synced_at = time.time()
+            self._stats["full_syncs"] += 1
+        return True
+
+    def incremental_sync(self, blocking=True):
+        """以 syncToken 拉取上次同步後的變更；token 失效（410）時改做完整同步
+
+        下載期間有自己的寫入時不套用、保留舊 token，下次同步會再取得同一批變更。
+        blocking 為 False 且其他執行緒正在同步時直接返回 False。
+        """
+        if not self._sync_lock.acquire(blocking):
+            return False
+        try:
+            return self._incremental_sync()
+        finally:
+            self._sync_lock.release()
+
+    def _incremental_sync(self):
+        with self._lock:
+            generation = self._generation
+            sync_token = self._sync_token
+        try:
+            items, next_token = self._pages(singleEvents=True, syncToken=sync_token)
+        except HttpError as error:
+            if error.resp.status == 410:
+                logger.info("Calendar syncToken 已失效，重新完整同步")
+                return self._full_sync()
+            raise
+        with self._lock:
+            self._synced_at = time.time()
+            if self._generation != generation:
+                self._stats["sync_conflicts"] += 1
+                return False
+            for event in items:
+                if event.get("status") == "cancelled":
+                    self._remove(event["id"])
+                else:
+                    self._put(event)
+            self._sync_token = next_token or self._sync_token
+            self._stats["incremental_syncs"] += 1
+            self._stats["delta_events"] += len(items)
+        return True
+
+    def ensure_fresh(self, attempts=3):
+        with self._lock:
+            synced = self._sync_token is not None
+            due = time.time() - self._synced_at >= self.sync_interval
+        if not synced:
+            # 尚未有任何資料，必須等完整同步完成
+            with self._sync_lock:
+                for attempt in range(attempts):
+                    if self._sync_token is not None:
+                        return
+                    if attempt == attempts - 1:
+                        # 連續衝突時的最後手段：下載期間持有 _lock，保證能套用
+                        with self._lock:
+                            self._full_sync()
+                        return
+                    if self._full_sync():
+                        return
+        elif due:
+            # 已有資料時，其他執行緒正在同步就直接使用目前的快取
+            self.incremental_sync(blocking=False)
+
+    def _put(self, event):
+        self._remove(event["id"])
+        self._events[event["id"]] = event
+        self._by_summary.setdefault(event.get("summary"), set()).add(event["id"])
+        bounds = self._bounds(event)
+        if self._index is not None and bounds is not None:
+            self._index.add(*bounds, event)
+
+    def _remove(self, event_id):
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+        ids = self._by_summary.get(event.get("summary"), set())
+        ids.discard(event_id)
+        if not ids:
+            self._by_summary.pop(event.get("summary"), None)
+        bounds = self._bounds(event)
+        if self._index is not None and bounds is not None:
+            self._index.remove(*bounds, event)
+
+    @staticmethod
+    def _bounds(event):
+        """返回事件的 (開始, 結束)；時間欄位不完整的事件不放入索引，返回 None"""
+        try:
+            return event_bounds(event)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _get_index(self):
+        # 完整同步後第一次查詢時建立，之後隨每筆變更增量更新
+        if self._index is None:
+            intervals = []
+            for event in self._events.values():
+                bounds = self._bounds(event)
+                if bounds is not None:
+                    intervals.append((*bounds, event))
+            self._index = IntervalIndex(intervals)
+        return self._index
+
+    def _query_index(self, method, *args):
+        self.ensure_fresh()
+        with self._lock:
+            self._stats["queries"] += 1
+            return [event for _, _, event in getattr(self._get_index(), method)(*args)]
+
+    def query(self, time_min, time_max):
+        """返回與 [time_min, time_max) 重疊的事件，依開始時間排序"""
+        return self._query_index(
+            "overlapping", to_timestamp(time_min), to_timestamp(time_max)
+        )
+
+    def at(self, moment):
+        """返回在某個時間點進行中的事件"""
+        return self._query_index("at", to_timestamp(moment))
+
+    def find_by_summary(self, summary, time_min, time_max):
+        """返回時間範圍內第一個標題相符的事件 ID"""
+        self.ensure_fresh()
+        lower, upper = to_timestamp(time_min), to_timestamp(time_max)
+        with self._lock:
+            candidates = []
+            for event_id in self._by_summary.get(summary, ()):
+                start, end = event_bounds(self._events[event_id])
+                if start < upper and end > lower:
+                    candidates.append((start, event_id))
+        return min(candidates)[1] if candidates else None
+
+    def apply_upsert(self, event):
+        """寫入自己新增或更新後的事件"""
+        if event.get("id"):
+            with self._lock:
+                self._generation += 1
+                self._put(event)
+
+    def apply_delete(self, event_id):
+        with self._lock:
+            self._generation += 1
+            self._remove(event_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["events"] = len(self._events)
+            stats["synced"] = self._sync_token is not None
+        return stats
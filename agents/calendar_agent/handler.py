@@ -1,42 +1,100 @@
-from agents.tools.token_handler import ensure_valid_token, get_calendar_service
+import json
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from agents.tools.client_pool import get_calendar_service
+from agents.tools.backends import backend_slot
+from agents.tools.singleflight import get_group
+from agents.calendar_agent.event_store import (
+    DEFAULT_TIMEZONE,
+    EVENT_CACHE_ENABLED,
+    PAGE_SIZE,
+    EventStore,
+    event_bounds,
+    to_timestamp,
+)
 from googleapiclient.errors import HttpError
 
+logger = logging.getLogger(__name__)
 
-def query_events(parameters):
-    """查詢日曆事件，檢查時間格式"""
-    try:
-        ensure_valid_token()
-        service = get_calendar_service()
-        calendar_id = "primary"
-        time_min = parameters.get("time_min")
-        time_max = parameters.get("time_max")
+# 只取回會用到的欄位（partial response），減少傳輸量與解析時間
+EVENT_FIELDS = "id,status,summary,description,location,start,end,transparency,htmlLink"
+LIST_FIELDS = f"nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
 
-        # 檢查 time_min 和 time_max 是否存在
-        if not time_min or not time_max:
-            return {"error": "time_min and time_max are required"}
 
-        # 確保時間格式一致
-        is_datetime_format = "T" in time_min and "T" in time_max
-        is_date_format = "T" not in time_min and "T" not in time_max
+# 相同參數的並行 events().list 只送出一次
+list_flight = get_group("calendar.events.list")
 
-        if not (is_datetime_format or is_date_format):
-            return {
-                "error": "time_min and time_max must either both be date or both be dateTime"
-            }
 
-        # 查詢事件
-        events_result = (
-            service.events()
-            .list(
-                calendarId=calendar_id,
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
-        events = events_result.get("items", [])
+def list_events(**params):
+    """在 primary 日曆執行一次 events().list，只返回一頁"""
+    params.setdefault("fields", LIST_FIELDS)
+    return list_flight.do(tuple(sorted(params.items())), lambda: _list_events(params))
+
+
+def _list_events(params):
+    service = get_calendar_service()
+    with backend_slot("calendar"):
+        return service.events().list(calendarId="primary", **params).execute()
+
+
+def iter_event_pages(page_size=PAGE_SIZE, **params):
+    """依 nextPageToken 逐頁產生事件列表，每取得一頁就先交出"""
+    page_token = None
+    while True:
+        response = list_events(maxResults=page_size, pageToken=page_token, **params)
+        yield response.get("items", [])
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+# primary 日曆的本地事件快取，以 syncToken 增量同步
+event_store = EventStore(list_events)
+
+
+def _check_time_range(parameters):
+    """檢查 time_min / time_max，格式錯誤時返回錯誤訊息"""
+    time_min = parameters.get("time_min")
+    time_max = parameters.get("time_max")
+
+    # 檢查 time_min 和 time_max 是否存在
+    if not time_min or not time_max:
+        return "time_min and time_max are required"
+
+    # 確保時間格式一致
+    is_datetime_format = "T" in time_min and "T" in time_max
+    is_date_format = "T" not in time_min and "T" not in time_max
+
+    if not (is_datetime_format or is_date_format):
+        return "time_min and time_max must either both be date or both be dateTime"
+    return None
+
+
+def iter_events(parameters):
+    """逐筆產生查詢結果；停用快取時每取得一頁就先送出，不必等全部頁面"""
+    if EVENT_CACHE_ENABLED:
+        yield from event_store.query(parameters["time_min"], parameters["time_max"])
+        return
+    for page in iter_event_pages(
+        page_size=int(parameters.get("page_size", PAGE_SIZE)),
+        timeMin=parameters["time_min"],
+        timeMax=parameters["time_max"],
+        singleEvents=True,
+        orderBy="startTime",
+    ):
+        yield from page
+
+
+def query_events(parameters):
+    """查詢日曆事件，檢查時間格式"""
+    try:
+        error = _check_time_range(parameters)
+        if error:
+            return {"error": error}
+
+        # 查詢事件（停用快取時會依 nextPageToken 取回所有頁面）
+        events = list(iter_events(parameters))
 
         return (
             events if events else {"message": "No events found in the specified range"}
@@ -47,10 +105,28 @@ def query_events(parameters):
         return {"error": f"Unexpected error: {str(e)}"}
 
 
+def stream_events(parameters):
+    """以 NDJSON 逐行輸出查詢結果，錯誤時輸出一行 error"""
+    try:
+        error = _check_time_range(parameters)
+        if error:
+            yield json.dumps({"error": error}, ensure_ascii=False) + "\n"
+            return
+        for event in iter_events(parameters):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    except HttpError as error:
+        yield json.dumps(
+            {"error": f"Google Calendar API Error: {error}"}, ensure_ascii=False
+        ) + "\n"
+    except Exception as e:
+        yield json.dumps(
+            {"error": f"Unexpected error: {str(e)}"}, ensure_ascii=False
+        ) + "\n"
+
+
 def create_event(data):
     """新增日曆事件"""
     try:
-        ensure_valid_token()
         service = get_calendar_service()
 
         # 構建事件資料
@@ -66,13 +142,14 @@ def create_event(data):
             },
         }
 
-        # 打印事件數據
-        print("發送的事件資料：", event)
+        logger.debug("發送的事件資料：%s", event)
 
         # 發送到 Google Calendar
-        created_event = (
-            service.events().insert(calendarId="primary", body=event).execute()
-        )
+        with backend_slot("calendar"):
+            created_event = (
+                service.events().insert(calendarId="primary", body=event).execute()
+            )
+        event_store.apply_upsert(created_event)
         return {"response": f"事件已建立: {created_event.get('htmlLink')}"}
     except Exception as e:
         return {"error": f"建立事件失敗: {str(e)}"}
@@ -81,12 +158,12 @@ def create_event(data):
 def update_event(parameters):
     """更新日曆事件"""
     try:
-        ensure_valid_token()
         service = get_calendar_service()
         event_id = parameters.get("event_id")
-        updated_event = (
-            service.events().get(calendarId="primary", eventId=event_id).execute()
-        )
+        with backend_slot("calendar"):
+            updated_event = (
+                service.events().get(calendarId="primary", eventId=event_id).execute()
+            )
 
         # 更新事件內容
         updated_event["summary"] = parameters.get("summary", updated_event["summary"])
@@ -103,9 +180,13 @@ def update_event(parameters):
             "timezone", updated_event["end"].get("timeZone", "Asia/Taipei")
         )
 
-        service.events().update(
-            calendarId="primary", eventId=event_id, body=updated_event
-        ).execute()
+        with backend_slot("calendar"):
+            updated_event = (
+                service.events()
+                .update(calendarId="primary", eventId=event_id, body=updated_event)
+                .execute()
+            )
+        event_store.apply_upsert(updated_event)
         return {"status": "success", "message": "Event updated successfully"}
     except HttpError as error:
         return {"error": f"Google Calendar API Error: {error}"}
@@ -116,14 +197,15 @@ def update_event(parameters):
 def delete_event(parameters):
     """刪除日曆事件"""
     try:
-        ensure_valid_token()
         service = get_calendar_service()
         event_id = parameters.get("event_id")
 
         if not event_id:
             return {"error": "event_id is required to delete an event"}
 
-        service.events().delete(calendarId="primary", eventId=event_id).execute()
+        with backend_slot("calendar"):
+            service.events().delete(calendarId="primary", eventId=event_id).execute()
+        event_store.apply_delete(event_id)
         return {"status": "success", "message": "Event deleted successfully"}
     except HttpError as error:
         return {"error": f"Google Calendar API Error: {error}"}
@@ -134,35 +216,141 @@ def delete_event(parameters):
 def find_event_id(summary, start_time, end_time):
     """根據標題和時間查詢事件，返回 event_id"""
     try:
-        ensure_valid_token()
-        service = get_calendar_service()
+        if EVENT_CACHE_ENABLED:
+            return event_store.find_by_summary(summary, start_time, end_time)
 
-        # 查詢事件列表
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=start_time,
-                timeMax=end_time,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
-        events = events_result.get("items", [])
-
-        # 查找匹配的事件
-        for event in events:
-            if event.get("summary") == summary:
-                return event.get("id")
+        # 逐頁查詢事件列表並查找匹配的事件
+        for page in iter_event_pages(
+            timeMin=start_time,
+            timeMax=end_time,
+            singleEvents=True,
+            orderBy="startTime",
+        ):
+            for event in page:
+                if event.get("summary") == summary:
+                    return event.get("id")
         return None  # 未找到匹配的事件
     except Exception as e:
-        print(f"查詢事件失敗: {e}")
+        logger.error(f"查詢事件失敗: {e}")
         return None
 
 
+def _format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, ZoneInfo(DEFAULT_TIMEZONE)).isoformat()
+
+
+def _blocking(events):
+    """排除標記為「有空」(transparent) 的事件"""
+    return [event for event in events if event.get("transparency") != "transparent"]
+
+
+def _events_between(time_min, time_max):
+    """返回與 [time_min, time_max) 重疊的事件，依開始時間排序
+
+    停用快取時只查詢這段時間，不觸發整個日曆的同步。
+    """
+    if EVENT_CACHE_ENABLED:
+        return event_store.query(time_min, time_max)
+    events = []
+    for page in iter_event_pages(
+        timeMin=time_min, timeMax=time_max, singleEvents=True, orderBy="startTime"
+    ):
+        events.extend(page)
+    return events
+
+
+def _events_at(moment):
+    """返回在某個時間點進行中的事件"""
+    if EVENT_CACHE_ENABLED:
+        return event_store.at(moment)
+    timestamp = to_timestamp(moment)
+    events = _events_between(
+        _format_timestamp(timestamp), _format_timestamp(timestamp + 1)
+    )
+    return [
+        event
+        for event in events
+        if event_bounds(event)[0] <= timestamp < event_bounds(event)[1]
+    ]
+
+
+def _event_summary(event):
+    start, end = event_bounds(event)
+    return {
+        "id": event.get("id"),
+        "summary": event.get("summary"),
+        "start": _format_timestamp(start),
+        "end": _format_timestamp(end),
+    }
+
+
+def free_busy(parameters):
+    """查詢某個時間點是否有空，或列出時間範圍內的忙碌與空閒時段"""
+    try:
+        if parameters.get("time"):
+            events = _blocking(_events_at(parameters["time"]))
+            return {
+                "time": parameters["time"],
+                "free": not events,
+                "events": [_event_summary(event) for event in events],
+            }
+
+        lower = to_timestamp(parameters["time_min"])
+        upper = to_timestamp(parameters["time_max"])
+        busy = []
+        for event in _blocking(
+            _events_between(parameters["time_min"], parameters["time_max"])
+        ):
+            start, end = event_bounds(event)
+            start, end = max(start, lower), min(end, upper)
+            # 事件已依開始時間排序，與上一段重疊時直接合併
+            if busy and start <= busy[-1][1]:
+                busy[-1][1] = max(busy[-1][1], end)
+            else:
+                busy.append([start, end])
+
+        free, cursor = [], lower
+        for start, end in busy:
+            if start > cursor:
+                free.append([cursor, start])
+            cursor = max(cursor, end)
+        if cursor < upper:
+            free.append([cursor, upper])
+
+        return {
+            "busy": [
+                {"start": _format_timestamp(a), "end": _format_timestamp(b)}
+                for a, b in busy
+            ],
+            "free": [
+                {"start": _format_timestamp(a), "end": _format_timestamp(b)}
+                for a, b in free
+            ],
+        }
+    except HttpError as error:
+        return {"error": f"Google Calendar API Error: {error}"}
+    except Exception as e:
+        return {"error": f"Unexpected error: {str(e)}"}
+
+
+def find_conflicts(parameters):
+    """列出與指定時段重疊的事件"""
+    try:
+        events = _blocking(
+            _events_between(parameters["start_time"], parameters["end_time"])
+        )
+        return {
+            "has_conflict": bool(events),
+            "conflicts": [_event_summary(event) for event in events],
+        }
+    except HttpError as error:
+        return {"error": f"Google Calendar API Error: {error}"}
+    except Exception as e:
+        return {"error": f"Unexpected error: {str(e)}"}
+
+
 def handle_command_calendar(command, parameters):
-    print(f"Command: {command}, Parameters: {parameters}")  # 調試日誌
+    logger.debug("Command: %s, Parameters: %s", command, parameters)
     if command == "query":
         if "time_min" not in parameters or "time_max" not in parameters:
             return {"error": "time_min and time_max are required for querying events"}
@@ -179,5 +367,21 @@ def handle_command_calendar(command, parameters):
         if "event_id" not in parameters:
             return {"error": "event_id is required for deleting an event"}
         return delete_event(parameters)
+    elif command == "free_busy":
+        if "time" not in parameters and (
+            "time_min" not in parameters or "time_max" not in parameters
+        ):
+            return {"error": "time or time_min and time_max are required for free_busy"}
+        return free_busy(parameters)
+    elif command == "conflicts":
+        if "start_time" not in parameters or "end_time" not in parameters:
+            return {
+                "error": "start_time and end_time are required for checking conflicts"
+            }
+        return find_conflicts(parameters)
     else:
         return {"error": "Unknown command"}
+
+
+def agent_stats():
+    return {"calendar_events": event_store.stats()}
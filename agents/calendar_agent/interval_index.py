@@ -0,0 +1,82 @@
+import bisect
+import math
+
+
+class IntervalIndex:
+    """區間索引
+
+    以開始時間排序的陣列作為隱式平衡二元樹（每段 [lo, hi) 的根為中點），
+    並記錄每棵子樹的最大結束時間，重疊查詢為 O(log n + k)，結果依開始時間排序。
+    新增 / 刪除單一項目只在排序陣列中插入或移除（不必重新排序），
+    子樹最大結束時間在下一次查詢時以 O(n) 重算。
+    """
+
+    def __init__(self, intervals):
+        # intervals: [(開始, 結束, 值)]
+        self._items = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self._keys = [(item[0], item[1]) for item in self._items]
+        self._starts = [item[0] for item in self._items]
+        self._max_end = []
+        self._dirty = True
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, start, end, value):
+        i = bisect.bisect_right(self._keys, (start, end))
+        self._items.insert(i, (start, end, value))
+        self._keys.insert(i, (start, end))
+        self._starts.insert(i, start)
+        self._dirty = True
+
+    def remove(self, start, end, value):
+        """移除 add 時傳入的同一個值；找不到返回 False"""
+        i = bisect.bisect_left(self._keys, (start, end))
+        while i < len(self._keys) and self._keys[i] == (start, end):
+            if self._items[i][2] is value:
+                del self._items[i], self._keys[i], self._starts[i]
+                self._dirty = True
+                return True
+            i += 1
+        return False
+
+    def _ensure_built(self):
+        if self._dirty:
+            self._max_end = [0.0] * len(self._items)
+            self._build(0, len(self._items))
+            self._dirty = False
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return -math.inf
+        mid = (lo + hi) // 2
+        self._max_end[mid] = max(
+            self._items[mid][1], self._build(lo, mid), self._build(mid + 1, hi)
+        )
+        return self._max_end[mid]
+
+    def overlapping(self, lower, upper):
+        """返回與 [lower, upper) 重疊（開始 < upper 且結束 > lower）的項目"""
+        self._ensure_built()
+        result = []
+        # 開始時間 >= upper 的項目一定不重疊，直接縮小搜尋範圍
+        hi = bisect.bisect_left(self._starts, upper)
+        self._collect(0, len(self._items), hi, lower, upper, result)
+        return result
+
+    def _collect(self, lo, hi, limit, lower, upper, result):
+        if lo >= hi or lo >= limit:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] <= lower:
+            return
+        self._collect(lo, mid, limit, lower, upper, result)
+        if mid < limit:
+            start, end, value = self._items[mid]
+            if end > lower and start < upper:
+                result.append(self._items[mid])
+            self._collect(mid + 1, hi, limit, lower, upper, result)
+
+    def at(self, moment):
+        """返回在 moment 這個時間點進行中的項目"""
+        return self.overlapping(moment, math.nextafter(moment, math.inf))
@@ -0,0 +1,180 @@
+import importlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+from agents.tools.tracing import span
+from utils.module_handler import get_function_names_from_file
+
+logger = logging.getLogger(__name__)
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_NAME = "manifest.json"
+
+
+class Agent:
+    """一個 agent 的描述與延遲載入的處理模組
+
+    manifest.json 的欄位：
+    - agent_type: 請求中的 agent_type，預設為目錄名稱去掉 _agent
+    - module: 處理模組（相對於 agent 套件），預設 handler
+    - handler: 處理函數名稱，接受 (command, parameters) 或只接受 (parameters)
+    - commands: 支援的命令（選填），用於限制指標標籤
+    - start / stop: 載入後與關閉時呼叫的函數名稱（選填）
+    - stats: 返回 {子系統: 統計} 的函數名稱（選填）
+    """
+
+    def __init__(self, package, manifest):
+        self.package = package
+        self.agent_type = manifest["agent_type"]
+        self.module_name = f"{package}.{manifest.get('module', 'handler')}"
+        self.handler_name = manifest["handler"]
+        self.commands = frozenset(manifest.get("commands", ()))
+        self.start_name = manifest.get("start")
+        self.stop_name = manifest.get("stop")
+        self.stats_name = manifest.get("stats")
+        self._lock = threading.Lock()
+        self._module = None
+        self._handler = None
+        self._takes_command = True
+        self._stats = {"loaded": False, "load_seconds": 0.0, "requests": 0}
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """第一次呼叫時匯入處理模組並執行 start，返回模組"""
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is not None:
+                return self._module
+            started = time.perf_counter()
+            with span(f"agent.load.{self.agent_type}"):
+                module = importlib.import_module(self.module_name)
+                handler = getattr(module, self.handler_name)
+                self._takes_command = len(inspect.signature(handler).parameters) > 1
+                if self.start_name:
+                    getattr(module, self.start_name)()
+            self._handler = handler
+            self._module = module
+            self._stats["loaded"] = True
+            self._stats["load_seconds"] = time.perf_counter() - started
+            logger.info(
+                f"已載入 agent {self.agent_type}（{self._stats['load_seconds']:.2f}s）"
+            )
+        return module
+
+    def handle(self, command, parameters):
+        self.load()
+        self._stats["requests"] += 1
+        if self._takes_command:
+            return self._handler(command, parameters)
+        return self._handler(parameters)
+
+    def stop(self):
+        if self._module is not None and self.stop_name:
+            getattr(self._module, self.stop_name)()
+
+    def subsystem_stats(self):
+        if self._module is None or not self.stats_name:
+            return {}
+        return getattr(self._module, self.stats_name)()
+
+    def stats(self):
+        return dict(self._stats)
+
+
+def read_manifest(directory, name):
+    """讀取 agent 目錄中的 manifest.json；沒有時從 handler.py 的函數名稱推斷"""
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    else:
+        handler_path = os.path.join(directory, "handler.py")
+        if not os.path.isfile(handler_path):
+            return None
+        # 只解析 AST，不匯入模組
+        handlers = [
+            function
+            for function in get_function_names_from_file(handler_path)
+            if function.startswith("handle_")
+        ]
+        if not handlers:
+            return None
+        manifest = {"handler": handlers[0]}
+    manifest.setdefault("agent_type", name[: -len("_agent")])
+    return manifest
+
+
+class AgentRegistry:
+    """agent_type -> Agent 的對照表
+
+    啟動時只掃描 agents/ 下的 *_agent 目錄與 manifest，不匯入任何處理模組；
+    模組在第一次收到請求或背景預熱時才載入。
+    """
+
+    def __init__(self, directory=AGENTS_DIR, package="agents"):
+        self.directory = directory
+        self.package = package
+        self._agents = {}
+        self.discover()
+
+    def discover(self):
+        agents = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not (os.path.isdir(path) and name.endswith("_agent")):
+                continue
+            try:
+                manifest = read_manifest(path, name)
+            except (OSError, ValueError, SyntaxError) as e:
+                logger.error(f"無法讀取 agent {name} 的描述: {e}")
+                continue
+            if manifest is None:
+                continue
+            agent = Agent(f"{self.package}.{name}", manifest)
+            agents[agent.agent_type] = agent
+        self._agents = agents
+        return list(agents)
+
+    def get(self, agent_type):
+        """返回 agent；不存在時返回 None"""
+        return self._agents.get(agent_type)
+
+    def load(self, agent_type):
+        """返回 agent 已載入的處理模組"""
+        return self._agents[agent_type].load()
+
+    def load_all(self):
+        for agent_type, agent in list(self._agents.items()):
+            try:
+                agent.load()
+            except Exception as e:
+                logger.error(f"預熱 agent {agent_type} 失敗: {e}")
+
+    def stop(self):
+        for agent_type, agent in list(self._agents.items()):
+            try:
+                agent.stop()
+            except Exception as e:
+                logger.error(f"關閉 agent {agent_type} 失敗: {e}")
+
+    def subsystem_stats(self):
+        """已載入 agent 的子系統統計（未載入的 agent 不會出現）"""
+        stats = {}
+        for agent in list(self._agents.values()):
+            stats.update(agent.subsystem_stats())
+        return stats
+
+    def stats(self):
+        return {agent_type: agent.stats() for agent_type, agent in self._agents.items()}
+
+
+# 全程序共用的 agent 對照表
+agent_registry = AgentRegistry()
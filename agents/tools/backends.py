@@ -0,0 +1,92 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from agents.tools.tracing import span
+
+# 後端名稱 -> (預設並行上限, 預設逾時秒數)
+# 可用環境變數覆寫，例如 BACKEND_SHEETS_CONCURRENCY=4、BACKEND_SHEETS_TIMEOUT=15
+DEFAULT_LIMITS = {
+    "openai": (8, 60),
+    "sheets": (8, 30),
+    "calendar": (8, 30),
+    "openweather": (16, 10),
+    "translator": (4, 10),
+}
+
+
+class BackendBusyError(RuntimeError):
+    """等待後端並行名額逾時"""
+
+
+class BackendLimiter:
+    """限制單一後端同時進行中的請求數，並記錄使用狀況"""
+
+    def __init__(self, name, concurrency, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "rejected": 0, "in_flight": 0, "max_in_flight": 0}
+
+    @contextmanager
+    def slot(self):
+        """取得一個並行名額，等待超過逾時秒數則拋出 BackendBusyError"""
+        with span(f"backend.{self.name}.wait"):
+            acquired = self._semaphore.acquire(timeout=self.timeout)
+        if not acquired:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise BackendBusyError(f"{self.name} 忙碌中，等待超過 {self.timeout} 秒")
+
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(
+                self._stats["max_in_flight"], self._stats["in_flight"]
+            )
+        try:
+            with span(f"backend.{self.name}"):
+                yield
+        finally:
+            with self._lock:
+                self._stats["in_flight"] -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["concurrency"] = self.concurrency
+        stats["timeout"] = self.timeout
+        return stats
+
+
+def _load_limiters():
+    limiters = {}
+    for name, (concurrency, timeout) in DEFAULT_LIMITS.items():
+        prefix = f"BACKEND_{name.upper()}"
+        limiters[name] = BackendLimiter(
+            name,
+            int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+            float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+        )
+    return limiters
+
+
+_limiters = _load_limiters()
+
+
+def backend_slot(name):
+    """用法: with backend_slot("sheets"): request.execute()"""
+    return _limiters[name].slot()
+
+
+def backend_timeout(name):
+    """返回後端的 I/O 逾時秒數"""
+    return _limiters[name].timeout
+
+
+def backend_stats():
+    """返回所有後端的並行使用統計"""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
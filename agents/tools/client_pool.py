@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+
+from agents.tools.backends import backend_timeout
+from agents.tools.token_handler import credential_manager
+from agents.tools.tracing import span
+
+# 服務名稱 -> (API 名稱, API 版本)
+SERVICES = {
+    "sheets": ("sheets", "v4"),
+    "calendar": ("calendar", "v3"),
+}
+# 離線 discovery 文件所在目錄，檔名為 <API 名稱>.<版本>.json（例如 sheets.v4.json）；
+# 找不到時使用 googleapiclient 套件內附、隨套件版本固定的文件，兩者都不需連網
+GOOGLE_DISCOVERY_DIR = os.getenv("GOOGLE_DISCOVERY_DIR", "")
+
+_documents = {}  # (API 名稱, 版本) -> (來源, 文件內容)
+_documents_lock = threading.Lock()
+
+
+def load_discovery_document(api_name, version):
+    """返回 discovery 文件的內容（字串），讀取一次後保存在記憶體中
+
+    build_from_document 會修改傳入的 dict，因此每次建構都從字串重新解析。
+    """
+    key = (api_name, version)
+    cached = _documents.get(key)
+    if cached is not None:
+        return cached[1]
+    with _documents_lock:
+        if key in _documents:
+            return _documents[key][1]
+        source, document = None, None
+        if GOOGLE_DISCOVERY_DIR:
+            path = os.path.join(GOOGLE_DISCOVERY_DIR, f"{api_name}.{version}.json")
+            if os.path.isfile(path):
+                with open(path, "r", encoding="utf-8") as document_file:
+                    source, document = path, document_file.read()
+        if document is None:
+            from googleapiclient import discovery_cache
+
+            source = "googleapiclient"
+            document = discovery_cache.get_static_doc(api_name, version)
+        if document is None:
+            raise FileNotFoundError(f"找不到 {api_name} {version} 的 discovery 文件")
+        _documents[key] = (source, document)
+        return document
+
+
+def load_discovery_documents():
+    """載入所有服務的 discovery 文件，返回 {服務名稱: 來源}"""
+    for api_name, version in SERVICES.values():
+        load_discovery_document(api_name, version)
+    return discovery_sources()
+
+
+def discovery_sources():
+    with _documents_lock:
+        documents = dict(_documents)
+    return {
+        name: documents[SERVICES[name]][0]
+        for name in SERVICES
+        if SERVICES[name] in documents
+    }
+
+
+class GoogleClientPool:
+    """Google API 客戶端池
+
+    全程序共用憑證管理器中的同一份憑證物件；service 物件則依執行緒各自快取，
+    因為底層的 httplib2 連線不是 thread-safe，不能跨執行緒共用。
+    預熱時建好的 service 放在備用池中，執行緒第一次使用時取走一份據為己有，不必自行建構。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._overrides = {}
+        self._spares = {name: [] for name in SERVICES}  # 服務名稱 -> [(世代, service)]
+        self._stats = {
+            name: {"hits": 0, "misses": 0, "checkouts": 0, "build_seconds": 0.0}
+            for name in SERVICES
+        }
+
+    def get_credentials(self):
+        """返回共用憑證與其世代編號；憑證由憑證管理器在記憶體中維護與刷新"""
+        creds = credential_manager.get()
+        # 憑證物件被換掉時世代編號會遞增，讓各執行緒快取的舊 service 失效
+        return creds, credential_manager.generation
+
+    def get(self, name):
+        """取得目前執行緒可用的 service，沒有就建立一份"""
+        if name not in SERVICES:
+            raise KeyError(f"Unknown Google service: {name}")
+        override = self._overrides.get(name)
+        if override is not None:
+            return override
+
+        with span("google.credentials"):
+            creds, generation = self.get_credentials()
+        services = getattr(self._local, "services", None)
+        if services is None:
+            services = self._local.services = {}
+
+        cached = services.get(name)
+        if cached is not None and cached[0] == generation:
+            with self._lock:
+                self._stats[name]["hits"] += 1
+            return cached[1]
+
+        spare = self._checkout(name, generation)
+        if spare is not None:
+            services[name] = (generation, spare)
+            return spare
+
+        service = self._build(name, creds)
+        services[name] = (generation, service)
+        with self._lock:
+            self._stats[name]["misses"] += 1
+        return service
+
+    def _checkout(self, name, generation):
+        """從備用池取出一份目前世代的 service；舊世代的直接丟棄"""
+        with self._lock:
+            spares = self._spares[name]
+            while spares:
+                spare_generation, service = spares.pop()
+                if spare_generation == generation:
+                    self._stats[name]["checkouts"] += 1
+                    return service
+        return None
+
+    def _build(self, name, creds):
+        # 延遲載入，伺服器啟動時不必載入 googleapiclient
+        import google_auth_httplib2
+        import httplib2
+        from googleapiclient.discovery import build_from_document
+
+        api_name, version = SERVICES[name]
+        started = time.perf_counter()
+        http = google_auth_httplib2.AuthorizedHttp(
+            creds, http=httplib2.Http(timeout=backend_timeout(name))
+        )
+        with span(f"google.build.{name}"):
+            document = load_discovery_document(api_name, version)
+            service = build_from_document(document, http=http)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats[name]["build_seconds"] += elapsed
+        return service
+
+    def set_override(self, name, service):
+        """以指定物件取代 service（壓測或測試時使用），傳入 None 取消"""
+        with self._lock:
+            if service is None:
+                self._overrides.pop(name, None)
+            else:
+                self._overrides[name] = service
+
+    def prebuild(self, count):
+        """為每個 service 預先建立 count 份放入備用池，返回各 service 的備用數量"""
+        creds, generation = self.get_credentials()
+        for name in SERVICES:
+            with self._lock:
+                spares = self._spares[name]
+                spares[:] = [spare for spare in spares if spare[0] == generation]
+                missing = count - len(spares)
+            for _ in range(missing):
+                service = self._build(name, creds)
+                with self._lock:
+                    self._spares[name].append((generation, service))
+        with self._lock:
+            return {name: len(spares) for name, spares in self._spares.items()}
+
+    def stats(self):
+        """返回各 service 的命中 / 未命中 / 取用備用次數、建構耗時與備用數量"""
+        with self._lock:
+            stats = {name: dict(values) for name, values in self._stats.items()}
+            for name, spares in self._spares.items():
+                stats[name]["spares"] = len(spares)
+        return stats
+
+
+# 全程序共用的客戶端池
+_pool = GoogleClientPool()
+
+
+def get_sheets_service():
+    """返回目前執行緒共用的 Google Sheets API 客戶端"""
+    return _pool.get("sheets")
+
+
+def get_calendar_service():
+    """返回目前執行緒共用的 Google Calendar API 客戶端"""
+    return _pool.get("calendar")
+
+
+def set_service_override(name, service):
+    """讓所有執行緒改用指定的 service 物件，例如離線壓測的替身"""
+    _pool.set_override(name, service)
+
+
+def prebuild_services(count):
+    """預先建立 count 份 Sheets 與 Calendar 客戶端，供各執行緒第一次使用時取用（啟動預熱時使用）"""
+    return _pool.prebuild(count)
+
+
+def pool_stats():
+    """返回客戶端池的統計數據"""
+    return _pool.stats()
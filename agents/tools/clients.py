@@ -0,0 +1,195 @@
+import os
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from agents.tools.backends import backend_timeout
+
+# requests 連線池：快取幾個主機的連線池，以及每個主機保留的連線數
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+# OpenAI 連線池大小
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "20"))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+# 解析用的 JSON 模式聊天模型
+LLM_JSON_MODEL = os.getenv("LLM_JSON_MODEL", "gpt-4o-mini")
+# 預熱時預先建立 keep-alive 連線的對象
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+
+class ClientRegistry:
+    """全程序共用的外部服務客戶端
+
+    - http: 帶 keep-alive 連線池的 requests.Session（OpenWeather 等 HTTP API）
+    - llm: 共用的 LangChain OpenAI 客戶端，底層 httpx 連線池同樣重複使用
+    - json_llm: 以 JSON 模式回應的聊天模型，用於解析，與 llm 共用連線池
+    在 app 啟動時建立；測試或壓測時可用 set_* 換成替身。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http = None
+        self._llm = None
+        self._json_llm = None
+        self._llm_http_client = None
+
+    def start(self):
+        """預先建立所有客戶端"""
+        self.http()
+        self.llm()
+        self.json_llm()
+
+    def preconnect(self, http_urls=()):
+        """對各主機送出 HEAD 請求，讓連線（含 TLS 交握）留在連線池中
+
+        只在乎連線是否建立，回應的狀態碼不重要；返回 {網址: 錯誤訊息或 None}。
+        """
+        results = {}
+        session = self.http()
+        for url in http_urls:
+            try:
+                session.head(url, timeout=backend_timeout("openweather"))
+                results[url] = None
+            except Exception as e:
+                results[url] = str(e)
+        self.llm()
+        # LLM 被替身取代時沒有連線池
+        client = self._llm_http_client
+        if client is not None:
+            try:
+                client.head(OPENAI_BASE_URL)
+                results[OPENAI_BASE_URL] = None
+            except Exception as e:
+                results[OPENAI_BASE_URL] = str(e)
+        return results
+
+    def http(self):
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=HTTP_POOL_CONNECTIONS,
+                        pool_maxsize=HTTP_POOL_MAXSIZE,
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._http = session
+        return self._http
+
+    def llm(self):
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    # 延遲載入，避免沒有使用 LLM 的程序也要載入 langchain
+                    from langchain_openai import OpenAI
+
+                    self._llm = OpenAI(
+                        temperature=LLM_TEMPERATURE,
+                        timeout=backend_timeout("openai"),
+                        http_client=self._get_llm_http_client(),
+                    )
+        return self._llm
+
+    def json_llm(self):
+        if self._json_llm is None:
+            with self._lock:
+                if self._json_llm is None:
+                    from langchain_openai import ChatOpenAI
+
+                    self._json_llm = ChatOpenAI(
+                        model=LLM_JSON_MODEL,
+                        temperature=0,
+                        timeout=backend_timeout("openai"),
+                        http_client=self._get_llm_http_client(),
+                        model_kwargs={"response_format": {"type": "json_object"}},
+                    )
+        return self._json_llm
+
+    def _get_llm_http_client(self):
+        # 呼叫端需持有 self._lock
+        if self._llm_http_client is None:
+            self._llm_http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_POOL_MAXSIZE,
+                    max_keepalive_connections=LLM_POOL_MAXSIZE,
+                ),
+                timeout=backend_timeout("openai"),
+            )
+        return self._llm_http_client
+
+    def set_http(self, session):
+        with self._lock:
+            self._http = session
+
+    def set_llm(self, llm):
+        with self._lock:
+            self._llm = llm
+
+    def set_json_llm(self, llm):
+        with self._lock:
+            self._json_llm = llm
+
+    def close(self):
+        with self._lock:
+            if self._http is not None:
+                self._http.close()
+            if self._llm_http_client is not None:
+                self._llm_http_client.close()
+            self._http = self._llm = self._json_llm = self._llm_http_client = None
+
+    def stats(self):
+        """返回各連線池的使用狀況"""
+        return {"http": self._http_stats(), "llm": self._llm_stats()}
+
+    def _http_stats(self):
+        pools = []
+        if self._http is None:
+            return {"maxsize": HTTP_POOL_MAXSIZE, "pools": pools}
+        # 測試替身可能沒有 adapters
+        for adapter in set(getattr(self._http, "adapters", {}).values()):
+            manager = getattr(adapter, "poolmanager", None)
+            if manager is None:
+                continue
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append(
+                    {
+                        "host": pool.host,
+                        "connections_created": pool.num_connections,
+                        "requests": pool.num_requests,
+                        "idle": pool.pool.qsize() if pool.pool is not None else 0,
+                    }
+                )
+        return {"maxsize": HTTP_POOL_MAXSIZE, "pools": pools}
+
+    def _llm_stats(self):
+        stats = {"maxsize": LLM_POOL_MAXSIZE, "connections": 0, "idle": 0}
+        client = self._llm_http_client
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is None:
+            return stats
+        connections = list(pool.connections)
+        stats["connections"] = len(connections)
+        stats["idle"] = sum(1 for connection in connections if connection.is_idle())
+        return stats
+
+
+# 全程序共用的客戶端
+clients = ClientRegistry()
+
+
+def get_http_session():
+    return clients.http()
+
+
+def get_llm():
+    return clients.llm()
+
+
+def get_json_llm():
+    return clients.json_llm()
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from agents.tools.tracing import span
+
+# 到期前多少秒開始背景刷新
+REFRESH_AHEAD_SECONDS = int(os.getenv("GOOGLE_TOKEN_REFRESH_AHEAD", "600"))
+# 背景執行緒最長的檢查間隔（秒）
+CHECK_INTERVAL_SECONDS = int(os.getenv("GOOGLE_TOKEN_CHECK_INTERVAL", "60"))
+# 刷新失敗後的重試間隔（秒）
+RETRY_INTERVAL_SECONDS = int(os.getenv("GOOGLE_TOKEN_RETRY_INTERVAL", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialsUnavailableError(RuntimeError):
+    """沒有可用的 Google 憑證，需先執行授權初始化指令"""
+
+
+class CredentialManager:
+    """在記憶體中持有 Google 憑證，並由背景執行緒在到期前以 refresh token 刷新
+
+    請求路徑只讀取記憶體中的憑證，不會讀寫 token 檔案，也不會觸發互動式授權。
+    """
+
+    def __init__(self, token_file, scopes):
+        self.token_file = token_file
+        self.scopes = scopes
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._creds = None
+        # 每次換上新的憑證物件時遞增，供客戶端池判斷是否需要重建 service
+        self.generation = 0
+        self._stats = {
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "last_refresh_seconds": 0.0,
+            "total_refresh_seconds": 0.0,
+            "last_refresh_at": None,
+            "last_error": None,
+        }
+
+    def load(self):
+        """從 token 檔案載入憑證到記憶體"""
+        if not os.path.exists(self.token_file):
+            raise CredentialsUnavailableError(
+                f"找不到 {self.token_file}，請先執行 python -m agents.tools.token_handler"
+            )
+        creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
+        with self._lock:
+            self._creds = creds
+            self.generation += 1
+        return creds
+
+    def install(self, creds):
+        """直接換上一份憑證（授權初始化或測試時使用）"""
+        with self._lock:
+            self._creds = creds
+            self.generation += 1
+
+    def get(self):
+        """返回記憶體中的憑證；只有從未載入過時才會讀取一次檔案"""
+        creds = self._creds
+        if creds is None:
+            with self._lock:
+                creds = self._creds
+            if creds is None:
+                creds = self.load()
+        return creds
+
+    def seconds_until_expiry(self):
+        """返回距離到期的秒數，沒有到期時間時返回 None"""
+        creds = self._creds
+        if creds is None or creds.expiry is None:
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (creds.expiry - now).total_seconds()
+
+    def refresh(self):
+        """以 refresh token 刷新憑證並原子寫回 token 檔案"""
+        creds = self.get()
+        if not creds.refresh_token:
+            raise CredentialsUnavailableError(
+                "憑證沒有 refresh token，請重新執行 python -m agents.tools.token_handler"
+            )
+
+        started = time.perf_counter()
+        try:
+            # 在複本上刷新，網路往返期間不持有鎖，stats() / install() 不會被擋住
+            fresh = Credentials.from_authorized_user_info(
+                json.loads(creds.to_json()), self.scopes
+            )
+            with span("google.token_refresh"):
+                fresh.refresh(Request())
+            with self._lock:
+                # 刷新期間被 install() / load() 換掉時，保留較新的那份
+                if self._creds is creds:
+                    self._creds = fresh
+                    self.generation += 1
+            self.persist(fresh)
+        except Exception as e:
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+                self._stats["last_error"] = str(e)
+            raise
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh_seconds"] = elapsed
+            self._stats["total_refresh_seconds"] += elapsed
+            self._stats["last_refresh_at"] = time.time()
+            self._stats["last_error"] = None
+        return fresh
+
+    def persist(self, creds):
+        """先寫入同目錄的暫存檔再 rename，避免中途失敗留下不完整的 token 檔案"""
+        directory = os.path.dirname(os.path.abspath(self.token_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                tmp_file.write(creds.to_json())
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.token_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _next_wait(self):
+        remaining = self.seconds_until_expiry()
+        if remaining is None:
+            return CHECK_INTERVAL_SECONDS
+        return max(0, min(CHECK_INTERVAL_SECONDS, remaining - REFRESH_AHEAD_SECONDS))
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self._next_wait()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            try:
+                self.refresh()
+                logger.info("Google Token 已於背景刷新")
+            except Exception as e:
+                logger.error(f"Google Token 背景刷新失敗: {e}")
+                self._stop.wait(RETRY_INTERVAL_SECONDS)
+
+    def start(self):
+        """載入憑證並啟動背景刷新執行緒"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        try:
+            self.get()
+        except Exception as e:
+            logger.error(f"Google 憑證載入失敗: {e}")
+            with self._lock:
+                self._stats["last_error"] = str(e)
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="google-token-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """停止背景刷新執行緒"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        """返回刷新次數、失敗次數與耗時等統計數據"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["loaded"] = self._creds is not None
+        stats["seconds_until_expiry"] = self.seconds_until_expiry()
+        return stats
@@ -0,0 +1,88 @@
+import copy
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "512"))
+PARSE_CACHE_TTL = float(os.getenv("PARSE_CACHE_TTL", "3600"))
+TIMEZONE = ZoneInfo("Asia/Taipei")
+
+# 含有這些字詞時，解析結果取決於「現在幾點」，以小時分桶
+_HOUR_RELATIVE = re.compile(r"現在|等一下|等等|待會|小時後|分鐘後|今晚|今早")
+_TRAILING_PUNCTUATION = "？?！!。.，,～~ "
+
+
+def normalize_text(text):
+    """全半形、大小寫與空白統一，去掉句尾標點"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(text.split()).strip(_TRAILING_PUNCTUATION)
+
+
+def date_bucket(text, now=None):
+    """相對時間字詞的分桶：同一桶內相同輸入的解析結果相同
+
+    LLM 會依提示中的現在時間填入絕對日期（例如「午餐120元」記在今天），
+    因此至少以當地日期分桶；含有小時相關字詞時再細分到小時。
+    """
+    now = now or datetime.now(TIMEZONE)
+    if _HOUR_RELATIVE.search(text):
+        return now.strftime("%Y-%m-%d %H")
+    return now.strftime("%Y-%m-%d")
+
+
+class ParseCache:
+    """自然語言解析結果的 LRU / TTL 快取
+
+    鍵為正規化後的輸入加上日期分桶，因此「明天」或未指明日期的輸入在不同日子會分別解析。
+    """
+
+    def __init__(self, max_size=PARSE_CACHE_SIZE, ttl=PARSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def key(text, now=None):
+        normalized = normalize_text(text)
+        return normalized, date_bucket(normalized, now)
+
+    def get(self, text):
+        key = self.key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            # 呼叫端可能會修改結果（例如補上 event_id），返回複本
+            return copy.deepcopy(entry[0])
+
+    def put(self, text, parsed, now=None):
+        """now 為解析時提供給 LLM 的現在時間，避免解析跨過分桶邊界時存到下一個桶"""
+        key = self.key(text, now)
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(parsed), time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,507 @@
+import logging
+import os
+import re
+import threading
+from datetime import datetime, time, timedelta
+
+from agents.tools.parse_cache import TIMEZONE, normalize_text
+
+# 設為 0 時停用規則解析，所有輸入都交給 LLM
+RULE_PARSER_ENABLED = os.getenv("RULE_PARSER", "1") == "1"
+# 信心分數達到此門檻才直接採用規則解析結果
+RULE_PARSER_THRESHOLD = float(os.getenv("RULE_PARSER_THRESHOLD", "0.9"))
+# 新增行程未指定結束時間時的預設長度
+DEFAULT_EVENT_MINUTES = int(os.getenv("RULE_PARSER_EVENT_MINUTES", "60"))
+
+logger = logging.getLogger(__name__)
+
+AGENT_KEYWORDS = {
+    "weather": (
+        "天氣",
+        "氣溫",
+        "溫度",
+        "下雨",
+        "降雨",
+        "帶傘",
+        "颱風",
+        "濕度",
+        "冷不冷",
+        "熱不熱",
+    ),
+    "accounting": (
+        "記帳",
+        "帳目",
+        "花了",
+        "花費",
+        "支出",
+        "收入",
+        "消費",
+        "開銷",
+    ),
+    "calendar": (
+        "行程",
+        "行事曆",
+        "日曆",
+        "會議",
+        "開會",
+        "約會",
+        "預約",
+        "提醒",
+        "活動",
+        "有空",
+        "空檔",
+    ),
+}
+
+# 依序比對，較具體的命令放前面
+COMMAND_KEYWORDS = (
+    ("conflicts", ("衝突", "撞期", "衝到")),
+    ("free_busy", ("有空", "空檔", "忙不忙", "有沒有空")),
+    ("delete", ("刪除", "刪掉", "取消", "移除")),
+    ("update", ("修改", "更新", "改成", "改到", "改為")),
+    ("add", ("新增", "加入", "記一筆", "記錄", "安排", "建立", "排入", "花了")),
+    ("query", ("查詢", "查", "看看", "列出", "有哪些", "多少", "如何", "怎樣", "嗎")),
+)
+
+# 記帳分類：關鍵字 -> 分類名稱
+CATEGORY_KEYWORDS = {
+    "餐飲": ("早餐", "午餐", "晚餐", "宵夜", "飲料", "咖啡", "餐廳", "吃飯", "便當"),
+    "交通": ("捷運", "公車", "計程車", "高鐵", "火車", "加油", "停車", "車資"),
+    "購物": ("購物", "衣服", "網購", "日用品"),
+    "娛樂": ("電影", "遊戲", "唱歌", "娛樂"),
+    "醫療": ("看醫生", "掛號", "藥", "醫療"),
+    "居住": ("房租", "水費", "電費", "瓦斯", "網路費"),
+}
+
+_CHINESE_DIGITS = {
+    "零": 0,
+    "一": 1,
+    "二": 2,
+    "兩": 2,
+    "三": 3,
+    "四": 4,
+    "五": 5,
+    "六": 6,
+    "七": 7,
+    "八": 8,
+    "九": 9,
+    "十": 10,
+}
+_WEEKDAYS = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+_RELATIVE_DAYS = {
+    "前天": -2,
+    "昨天": -1,
+    "今天": 0,
+    "今日": 0,
+    "明天": 1,
+    "明日": 1,
+    "後天": 2,
+}
+_NUMBER = r"\d{1,2}|[零一二兩三四五六七八九十]{1,3}"
+
+_ISO_DATE = re.compile(r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})")
+_MONTH_DAY = re.compile(r"(\d{1,2})(?:/|月)(\d{1,2})(?:日|號)?")
+_YEARS = {"前年": -2, "去年": -1, "今年": 0, "明年": 1, "後年": 2}
+_YEAR = re.compile("|".join(_YEARS))
+_RELATIVE_DAY = re.compile("|".join(_RELATIVE_DAYS))
+_WEEKDAY = re.compile(r"([這本下上]?)(?:個)?(?:週|周|星期|禮拜)([一二三四五六日天])")
+_PERIOD = re.compile(r"([這本下上])(?:個)?(週|周|星期|禮拜|月)")
+_TIME = re.compile(
+    rf"(凌晨|今早|早上|上午|中午|下午|傍晚|今晚|晚上)?\s*({_NUMBER})\s*(?:點|時|:)\s*(半|\d{{1,2}})?分?"
+)
+_AMOUNT = re.compile(
+    r"(\d+(?:\.\d+)?)\s*(?:元|塊|塊錢|nt|ntd)|(?:\$|nt\$?)\s*(\d+(?:\.\d+)?)"
+)
+# 地點名稱後的行政區後綴
+_ADMIN_SUFFIXES = "市縣區鄉鎮"
+_RANGE_SEPARATOR = re.compile(r"^\s*(?:到|至|-|~|～)\s*")
+# 從行程標題中去除的贅字
+_FILLER = re.compile(r"幫我|請|我要|我想|一個|一下|行程|行事曆|日曆|從|到|至")
+_SUMMARY_AFFIX = re.compile(
+    r"^(?:我要|我想|我|要|把|將|那個|這個|的)+|(?:的|了|吧|嗎|呢)+$|^[，,。:：]+|[，,。:：]+$"
+)
+# 去掉前後贅字後仍含有這些字，代表不是單純的名詞片語，交給 LLM
+_SUMMARY_PARTICLES = re.compile(r"[的了嗎呢吧把將，,。:：]")
+# 句尾是疑問語氣時不執行新增 / 更新 / 刪除（「我花了200元嗎」不是要記帳）
+_QUESTION = re.compile(r"(?:嗎|呢|麼|么)$")
+_MUTATING_COMMANDS = ("add", "update", "delete")
+
+
+def _chinese_number(text):
+    """將 1~99 的阿拉伯或中文數字轉成整數"""
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return _CHINESE_DIGITS.get(tens, 1) * 10 + (_CHINESE_DIGITS.get(ones, 0))
+    return _CHINESE_DIGITS[text]
+
+
+class Extraction:
+    """一段輸入中抽取出的日期、時間與金額，以及被使用的文字範圍"""
+
+    def __init__(self, text, now):
+        self.text = text
+        self.now = now
+        self.spans = []
+        self.date = None
+        self.period = None  # (開始日期, 結束日期)，例如「這個月」
+        self.times = []
+        self.amount = None
+        self.command = None
+        # 日期是否指定了年份（完整日期或「明年」等字詞）；沒有時預設為今年
+        self.explicit_year = False
+        self._extract()
+
+    def _mark(self, match):
+        self.spans.append(match.span())
+
+    def _extract(self):
+        today = self.now.date()
+        match = _ISO_DATE.search(self.text)
+        if match:
+            self._mark(match)
+            self.date = datetime(*map(int, match.groups())).date()
+            self.explicit_year = True
+        elif _MONTH_DAY.search(self.text):
+            match = _MONTH_DAY.search(self.text)
+            self._mark(match)
+            month, day = map(int, match.groups())
+            year = today.year
+            year_match = _YEAR.search(self.text)
+            if year_match:
+                self._mark(year_match)
+                year += _YEARS[year_match.group(0)]
+                self.explicit_year = True
+            self.date = today.replace(year=year, month=month, day=day)
+        elif _RELATIVE_DAY.search(self.text):
+            match = _RELATIVE_DAY.search(self.text)
+            self._mark(match)
+            self.date = today + timedelta(days=_RELATIVE_DAYS[match.group(0)])
+        elif _WEEKDAY.search(self.text):
+            match = _WEEKDAY.search(self.text)
+            self._mark(match)
+            prefix, weekday = match.group(1), _WEEKDAYS[match.group(2)]
+            monday = today - timedelta(days=today.weekday())
+            offset = {"下": 7, "上": -7}.get(prefix, 0)
+            self.date = monday + timedelta(days=weekday + offset)
+            if not prefix and self.date < today:
+                # 沒有「這/下」時指最近的一個，已經過了就是下週
+                self.date += timedelta(days=7)
+        elif _PERIOD.search(self.text):
+            match = _PERIOD.search(self.text)
+            self._mark(match)
+            self.period = self._period(match.group(1), match.group(2), today)
+
+        for match in _TIME.finditer(self.text):
+            hour = _chinese_number(match.group(2))
+            minute = match.group(3)
+            minute = 30 if minute == "半" else int(minute or 0)
+            if match.group(1) in ("今晚", "晚上") and hour == 12:
+                # 「今晚12點」是午夜，日期是今天還是明天要看語意，交給 LLM
+                raise ValueError("midnight is ambiguous")
+            if match.group(1) in ("下午", "傍晚", "今晚", "晚上") and hour < 12:
+                hour += 12
+            if match.group(1) == "中午" and hour < 6:
+                hour += 12
+            if hour > 23 or minute > 59:
+                continue
+            self._mark(match)
+            self.times.append((time(hour, minute), match.span()))
+
+        match = _AMOUNT.search(self.text)
+        if match:
+            self._mark(match)
+            self.amount = float(match.group(1) or match.group(2))
+            if self.amount.is_integer():
+                self.amount = int(self.amount)
+
+    @staticmethod
+    def _period(prefix, unit, today):
+        offset = {"下": 1, "上": -1}.get(prefix, 0)
+        if unit == "月":
+            month_index = today.year * 12 + today.month - 1 + offset
+            start = today.replace(
+                year=month_index // 12, month=month_index % 12 + 1, day=1
+            )
+            next_index = month_index + 1
+            end = start.replace(year=next_index // 12, month=next_index % 12 + 1)
+            return start, end - timedelta(days=1)
+        start = today - timedelta(days=today.weekday()) + timedelta(days=7 * offset)
+        return start, start + timedelta(days=6)
+
+    def day_range(self):
+        """返回輸入所指的日期範圍，未指定時為今天"""
+        if self.period:
+            return self.period
+        day = self.date or self.now.date()
+        return day, day
+
+    def time_range(self):
+        """返回 (開始, 結束) datetime；第二個時間緊接在「到」之後時視為結束時間"""
+        if not self.times:
+            return None
+        day = self.date or self.now.date()
+        start = datetime.combine(day, self.times[0][0], TIMEZONE)
+        end = start + timedelta(minutes=DEFAULT_EVENT_MINUTES)
+        if len(self.times) > 1:
+            between = self.text[self.times[0][1][1] : self.times[1][1][0]]
+            if _RANGE_SEPARATOR.match(between) or not between.strip():
+                end = datetime.combine(day, self.times[1][0], TIMEZONE)
+                if end <= start:
+                    end += timedelta(hours=12) if end.hour < 12 else timedelta(days=1)
+        return start, end
+
+    def remainder(self):
+        """去掉已抽取的日期、時間與金額後剩下的文字"""
+        chars = list(self.text)
+        for start, end in self.spans:
+            for i in range(start, end):
+                chars[i] = " "
+        return "".join(chars)
+
+
+def _iso(moment):
+    return moment.isoformat(timespec="seconds")
+
+
+def _day_bounds(start_day, end_day):
+    start = datetime.combine(start_day, time(0, 0), TIMEZONE)
+    end = datetime.combine(end_day + timedelta(days=1), time(0, 0), TIMEZONE)
+    return _iso(start), _iso(end)
+
+
+class RuleParser:
+    """以關鍵字與正規表示式解析明確的輸入，產生與 LLM 相同格式的結構化請求
+
+    parse() 返回 (結果, 信心分數, 原因)；分數未達門檻時結果為 None，
+    由呼叫端改用 LLM 解析。
+    """
+
+    def __init__(self, threshold=RULE_PARSER_THRESHOLD, locations=()):
+        self.threshold = threshold
+        # 可辨識的天氣地點（例如地點對照表中的縣市）
+        self.locations = sorted(locations, key=len, reverse=True)
+        self._lock = threading.Lock()
+        self._stats = {"rule": 0, "fallback": 0}
+
+    def parse(self, user_input, now=None):
+        now = now or datetime.now(TIMEZONE)
+        text = normalize_text(user_input)
+        try:
+            result, confidence, reason = self._classify(text, user_input, now)
+        except ValueError as e:
+            # 例如「2/30」這類不存在的日期
+            result, confidence, reason = None, 0.0, f"invalid value: {e}"
+        accepted = result is not None and confidence >= self.threshold
+        with self._lock:
+            self._stats["rule" if accepted else "fallback"] += 1
+        # 記錄每次判斷，方便依實際流量調整規則
+        logger.info(
+            "rule_parser decision=%s confidence=%.2f reason=%s input=%r",
+            "rule" if accepted else "llm",
+            confidence,
+            reason,
+            user_input,
+        )
+        return (result if accepted else None), confidence, reason
+
+    def _classify(self, text, user_input, now):
+        agents = [
+            agent
+            for agent, keywords in AGENT_KEYWORDS.items()
+            if any(keyword in text for keyword in keywords)
+        ]
+        extraction = Extraction(text, now)
+        if not agents and extraction.amount is not None:
+            agents = ["accounting"]
+        if len(agents) != 1:
+            return None, 0.0, f"agents={agents or 'none'}"
+        agent = agents[0]
+
+        command = next(
+            (
+                name
+                for name, keywords in COMMAND_KEYWORDS
+                if any(keyword in text for keyword in keywords)
+            ),
+            None,
+        )
+        confidence = 0.4
+        if agent == "weather":
+            # 天氣只有查詢一種命令
+            command = "query"
+        elif agent == "accounting" and command is None and extraction.amount:
+            # 「午餐 120 元」這類只有金額的輸入視為記一筆
+            command = "add"
+        if command is None:
+            return None, confidence, "no command keyword"
+        if command in _MUTATING_COMMANDS and (
+            _QUESTION.search(text) or user_input.rstrip().endswith(("?", "？"))
+        ):
+            return None, confidence, f"question for {agent}.{command}"
+        confidence += 0.3
+        extraction.command = command
+
+        build = getattr(self, f"_{agent}_{command}", None)
+        if build is None:
+            return None, confidence, f"unsupported {agent}.{command}"
+        parameters = build(extraction, user_input)
+        if parameters is None:
+            return None, confidence, f"missing parameters for {agent}.{command}"
+        confidence += 0.3
+        request = {"agent_type": agent, "command": command, "parameters": parameters}
+        return request, confidence, f"{agent}.{command}"
+
+    # 天氣
+
+    def _weather_query(self, extraction, user_input):
+        text = extraction.text.replace("臺", "台")
+        location = next((name for name in self.locations if name in text), None)
+        if location is None:
+            return None
+        # 連同行政區後綴一起交給天氣 agent，由地點對照表判斷層級（「信義鄉」不是「信義」）
+        following = text[text.index(location) + len(location) :][:1]
+        if following and following in _ADMIN_SUFFIXES:
+            location += following
+        if extraction.date and extraction.date < extraction.now.date():
+            # 只能查預報；例如年底說「1/1」時年份無法確定，交給 LLM
+            return None
+        moment = extraction.time_range()
+        if moment:
+            target = moment[0]
+        elif extraction.date:
+            target = datetime.combine(extraction.date, time(12, 0), TIMEZONE)
+        else:
+            target = extraction.now
+        return {
+            "query": user_input,
+            "location": location,
+            "datetime": target.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    # 記帳
+
+    @staticmethod
+    def _category(extraction):
+        for category, keywords in CATEGORY_KEYWORDS.items():
+            for keyword in (category,) + keywords:
+                if keyword in extraction.text:
+                    return category, keyword
+        return None, None
+
+    def _accounting_query(self, extraction, user_input):
+        parameters = {}
+        if extraction.date or extraction.period:
+            start, end = extraction.day_range()
+            parameters["date_range"] = [start.isoformat(), end.isoformat()]
+        category, _ = self._category(extraction)
+        if category:
+            parameters["category"] = category
+        if not parameters:
+            # 沒有任何篩選條件時不直接查詢整本帳，交給 LLM 判斷
+            return None
+        return parameters
+
+    def _accounting_add(self, extraction, user_input):
+        category, keyword = self._category(extraction)
+        if extraction.amount is None or category is None:
+            return None
+        return {
+            "date": (extraction.date or extraction.now.date()).isoformat(),
+            "category": category,
+            "amount": extraction.amount,
+            "description": keyword,
+        }
+
+    def _accounting_key(self, extraction):
+        category, _ = self._category(extraction)
+        if extraction.date is None or category is None:
+            return None
+        return {"date": extraction.date.isoformat(), "category": category}
+
+    def _accounting_update(self, extraction, user_input):
+        parameters = self._accounting_key(extraction)
+        if parameters is None or extraction.amount is None:
+            return None
+        parameters["amount"] = extraction.amount
+        return parameters
+
+    def _accounting_delete(self, extraction, user_input):
+        return self._accounting_key(extraction)
+
+    # 行程
+
+    @staticmethod
+    def _summary(extraction):
+        remainder = extraction.remainder()
+        for keyword in dict(COMMAND_KEYWORDS)[extraction.command]:
+            remainder = remainder.replace(keyword, " ")
+        remainder = _FILLER.sub(" ", remainder)
+        words = [_SUMMARY_AFFIX.sub("", word) for word in remainder.split()]
+        words = [word for word in words if word]
+        # 只接受一段乾淨的名詞片語，例如「牙醫」；其餘情況交給 LLM
+        if len(words) != 1 or _SUMMARY_PARTICLES.search(words[0]):
+            return None
+        return words[0]
+
+    def _calendar_range(self, extraction):
+        time_min, time_max = _day_bounds(*extraction.day_range())
+        return {"time_min": time_min, "time_max": time_max, "timezone": "Asia/Taipei"}
+
+    def _calendar_query(self, extraction, user_input):
+        return self._calendar_range(extraction)
+
+    def _calendar_free_busy(self, extraction, user_input):
+        moment = extraction.time_range()
+        if moment and len(extraction.times) == 1:
+            return {"time": _iso(moment[0]), "timezone": "Asia/Taipei"}
+        parameters = self._calendar_range(extraction)
+        if moment:
+            parameters["time_min"], parameters["time_max"] = map(_iso, moment)
+        return parameters
+
+    def _calendar_conflicts(self, extraction, user_input):
+        moment = extraction.time_range()
+        if moment is None:
+            return None
+        start, end = moment
+        return {
+            "start_time": _iso(start),
+            "end_time": _iso(end),
+            "timezone": "Asia/Taipei",
+        }
+
+    def _calendar_add(self, extraction, user_input):
+        moment = extraction.time_range()
+        summary = self._summary(extraction)
+        if moment is None or summary is None:
+            return None
+        start, end = moment
+        return {
+            "summary": summary,
+            "start_time": _iso(start),
+            "end_time": _iso(end),
+            "timezone": "Asia/Taipei",
+        }
+
+    def _calendar_delete(self, extraction, user_input):
+        summary = self._summary(extraction)
+        if summary is None or not (extraction.date or extraction.period):
+            return None
+        # 刪除以標題搜尋當天的事件，event_id 由呼叫端查詢
+        start_time, end_time = _day_bounds(*extraction.day_range())
+        return {
+            "summary": summary,
+            "start_time": start_time,
+            "end_time": end_time,
+            "timezone": "Asia/Taipei",
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats["rule"] + stats["fallback"]
+        stats["rule_rate"] = stats["rule"] / total if total else 0.0
+        stats["threshold"] = self.threshold
+        return stats
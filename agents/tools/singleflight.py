@@ -0,0 +1,91 @@
+import os
+import threading
+
+# 設為 0 時停用合併，每次呼叫都各自送出請求
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT", "1") == "1"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    """合併同時進行的相同後端呼叫
+
+    同一個 key 已有呼叫在進行時，之後的呼叫不再送出請求，而是等待並共用
+    第一個呼叫的結果（或例外）。結果由多個呼叫端共用，不應就地修改。
+    """
+
+    def __init__(self, name, enabled=SINGLEFLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"calls": 0, "executions": 0, "shared": 0, "errors": 0}
+
+    def do(self, key, fn):
+        """執行 fn() 並返回結果；相同 key 的並行呼叫只執行一次"""
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["executions"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            # 先移除再喚醒，之後的呼叫會重新送出請求而不是拿到舊結果
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        stats["coalescing_ratio"] = (
+            stats["shared"] / stats["calls"] if stats["calls"] else 0.0
+        )
+        return stats
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name):
+    """返回指定名稱的合併群組，不存在時建立"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = Group(name)
+        return _groups[name]
+
+
+def singleflight_stats():
+    with _groups_lock:
+        groups = dict(_groups)
+    return {name: group.stats() for name, group in groups.items()}
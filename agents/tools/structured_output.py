@@ -0,0 +1,80 @@
+import ast
+import json
+import logging
+import re
+import threading
+
+from agents.tools.backends import backend_slot
+from agents.tools.clients import get_json_llm
+
+logger = logging.getLogger(__name__)
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+_lock = threading.Lock()
+_stats = {"parsed": 0, "repaired": 0, "failed": 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def extract_json(text):
+    """從模型輸出中取出 JSON 物件並轉成 dict
+
+    先直接以 json 解析；失敗時去除 Markdown 程式碼區塊與前後說明文字、
+    移除多餘的逗號，最後以 literal_eval 處理單引號與 True/None 等 Python 寫法。
+    返回 (dict, 是否經過修復)，無法修復時拋出 ValueError。
+    """
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, False
+    except ValueError:
+        pass
+
+    candidate = _FENCE.sub("", text)
+    start, end = candidate.find("{"), candidate.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"回應中沒有 JSON 物件: {text[:200]!r}")
+    candidate = _TRAILING_COMMA.sub(r"\1", candidate[start : end + 1])
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        try:
+            data = ast.literal_eval(candidate)
+        except (SyntaxError, ValueError) as e:
+            raise ValueError(f"無法解析 JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise ValueError("回應不是 JSON 物件")
+    return data, True
+
+
+def parse_structured(text, adapter):
+    """將模型輸出修復並以 pydantic TypeAdapter 驗證，失敗時拋出 ValueError"""
+    try:
+        data, repaired = extract_json(text)
+        result = adapter.validate_python(data)
+    except ValueError:
+        # pydantic 的 ValidationError 也是 ValueError
+        _count("failed")
+        raise
+    if repaired:
+        logger.info("LLM 回應經本地修復後解析成功")
+    _count("repaired" if repaired else "parsed")
+    return result
+
+
+def complete_json(prompt, adapter):
+    """以 JSON 模式呼叫 LLM，返回驗證後的模型"""
+    with backend_slot("openai"):
+        message = get_json_llm().invoke(prompt)
+    return parse_structured(getattr(message, "content", message), adapter)
+
+
+def structured_output_stats():
+    with _lock:
+        return dict(_stats)
@@ -1,7 +1,4 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import os
+from agents.tools.credential_manager import CredentialManager
 
 # 路徑設置
 CREDENTIALS_FILE = "/home/ntc/dino/LLMTwins/tokens/credentials.json"
@@ -11,35 +8,40 @@ SCOPES = [
     "https://www.googleapis.com/auth/calendar",
 ]
 
+# 全程序共用的憑證管理器
+credential_manager = CredentialManager(TOKEN_FILE, SCOPES)
+
 
 def ensure_valid_token():
-    """檢查並生成 Token，如果無效則重新生成"""
-    creds = None
-
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-
-    if not creds or not creds.valid:
-        print("Token 無效或過期，正在重新生成...")
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, "w") as token_file:
-            token_file.write(creds.to_json())
-        print("新的 Token 已成功生成並保存至 token.json")
-    else:
-        print("Token 可用且有效")
+    """返回記憶體中的憑證，刷新由背景執行緒負責，不會觸發互動式授權"""
+    return credential_manager.get()
+
+
+def bootstrap_token():
+    """執行互動式授權流程並保存 Token（僅供初始化指令使用）"""
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+    creds = flow.run_local_server(port=0)
+    credential_manager.persist(creds)
+    credential_manager.install(creds)
+    print("新的 Token 已成功生成並保存至 token.json")
     return creds
 
 
 def get_sheets_service():
-    """返回 Google Sheets API 客戶端"""
-    creds = ensure_valid_token()
-    service = build("sheets", "v4", credentials=creds)
-    return service
+    """返回 Google Sheets API 客戶端（由客戶端池共用）"""
+    from agents.tools.client_pool import get_sheets_service as pooled
+
+    return pooled()
 
 
 def get_calendar_service():
-    """返回 Google Calendar API 客戶端"""
-    creds = ensure_valid_token()
-    service = build("calendar", "v3", credentials=creds)
-    return service
+    """返回 Google Calendar API 客戶端（由客戶端池共用）"""
+    from agents.tools.client_pool import get_calendar_service as pooled
+
+    return pooled()
+
+
+if __name__ == "__main__":
+    bootstrap_token()
@@ -0,0 +1,236 @@
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+# 設為 0 時停用計時，span() 直接返回空的 context manager
+TRACING_ENABLED = os.getenv("TRACING", "1") == "1"
+# 設為 1 時在回應加上 Server-Timing 標頭，列出本次請求各階段的耗時
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "0") == "1"
+# 延遲直方圖的區間上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_PREFIX = "llmtwins"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [各區間計數, 總和, 次數]
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total, count))
+                for labels, (counts, total, count) in self._values.items()
+            )
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                label_text = _labels(self.labelnames, labels, [("le", bound)])
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _labels(self.labelnames, labels, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{label_text} {count}")
+            label_text = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    f"{METRIC_PREFIX}_stage_seconds", "Latency of each processing stage", ("stage",)
+)
+STAGE_ERRORS = Counter(
+    f"{METRIC_PREFIX}_stage_errors_total", "Exceptions raised per stage", ("stage",)
+)
+AGENT_SECONDS = Histogram(
+    f"{METRIC_PREFIX}_agent_request_seconds",
+    "Agent handler latency",
+    ("agent", "command"),
+)
+AGENT_ERRORS = Counter(
+    f"{METRIC_PREFIX}_agent_errors_total",
+    "Agent requests that returned an error",
+    ("agent", "command"),
+)
+HTTP_SECONDS = Histogram(
+    f"{METRIC_PREFIX}_http_request_seconds",
+    "HTTP request latency",
+    ("method", "path", "status"),
+)
+METRICS = (STAGE_SECONDS, STAGE_ERRORS, AGENT_SECONDS, AGENT_ERRORS, HTTP_SECONDS)
+
+
+class Trace:
+    """單一請求中各階段的耗時，供 Server-Timing 標頭使用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.spans.append((stage, seconds))
+
+    def server_timing(self, total=None):
+        """同名階段合併計算，例如 backend.sheets;dur=12.3;desc="x2" """
+        durations, counts = {}, {}
+        with self._lock:
+            for stage, seconds in self.spans:
+                durations[stage] = durations.get(stage, 0.0) + seconds
+                counts[stage] = counts.get(stage, 0) + 1
+        parts = []
+        for stage, seconds in durations.items():
+            part = f"{stage};dur={seconds * 1000:.1f}"
+            if counts[stage] > 1:
+                part += f';desc="x{counts[stage]}"'
+            parts.append(part)
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_trace = ContextVar("trace", default=None)
+
+
+def start_trace():
+    """開始記錄目前請求的階段耗時，返回 (trace, token)"""
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(self.stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.stage, elapsed)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage):
+    """用法: with span("parse.llm"): ...；停用時幾乎沒有額外成本"""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage)
+
+
+def record_agent_request(agent, command, seconds, failed):
+    if not TRACING_ENABLED:
+        return
+    AGENT_SECONDS.observe(seconds, agent, command)
+    if failed:
+        AGENT_ERRORS.inc(agent, command)
+
+
+def record_http_request(method, path, status, seconds):
+    if TRACING_ENABLED:
+        HTTP_SECONDS.observe(seconds, method, path, status)
+
+
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _flatten(prefix, value, lines):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        lines.append(f"{prefix} {value}")
+    elif isinstance(value, dict):
+        for key, child in value.items():
+            _flatten(f"{prefix}_{_INVALID_NAME.sub('_', str(key))}", child, lines)
+
+
+def render_metrics(stats=None):
+    """以 Prometheus 文字格式輸出直方圖、計數器，以及各子系統統計中的數值"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for subsystem, values in (stats or {}).items():
+        _flatten(f"{METRIC_PREFIX}_{subsystem}", values, lines)
+    return "\n".join(lines) + "\n"
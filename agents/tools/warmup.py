@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+import time
+
+from agents.tools.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# 設為 0 時不預熱，啟動後立即就緒，各項資源在第一次使用時才建立
+WARMUP_ENABLED = os.getenv("WARMUP", "1") == "1"
+# 要執行的預熱步驟（逗號分隔），未列出的步驟略過
+WARMUP_STEPS = [
+    step.strip()
+    for step in os.getenv(
+        "WARMUP_STEPS", "discovery,clients,agents,google,connections"
+    ).split(",")
+    if step.strip()
+]
+
+
+class Warmup:
+    """啟動時依序在背景執行的預熱步驟，全部完成後才回報就緒
+
+    步驟失敗只會記錄下來，不會阻止就緒，避免外部服務暫時不可用時服務永遠無法接流量。
+    """
+
+    def __init__(self, enabled=WARMUP_ENABLED, steps=WARMUP_STEPS):
+        self.enabled = enabled
+        self.selected = steps
+        self._steps = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._results = {}
+        self._started_at = None
+        self._seconds = None
+
+    def step(self, name):
+        """註冊預熱步驟的裝飾器，依註冊順序執行"""
+
+        def register(fn):
+            self._steps.append((name, fn))
+            return fn
+
+        return register
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        if not self.enabled:
+            self._ready.set()
+            return
+        if self._thread is not None:
+            return
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        started = time.perf_counter()
+        for name, fn in self._steps:
+            if name not in self.selected:
+                continue
+            step_started = time.perf_counter()
+            result = {"ok": True}
+            try:
+                with span(f"warmup.{name}"):
+                    detail = fn()
+                if detail is not None:
+                    result["detail"] = detail
+            except Exception as e:
+                logger.error(f"預熱步驟 {name} 失敗: {e}")
+                result = {"ok": False, "error": str(e)}
+            result["seconds"] = round(time.perf_counter() - step_started, 3)
+            with self._lock:
+                self._results[name] = result
+        self._seconds = time.perf_counter() - started
+        self._ready.set()
+        logger.info(f"預熱完成，耗時 {self._seconds:.2f}s")
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            steps = {name: dict(result) for name, result in self._results.items()}
+        return {
+            "ready": self.ready,
+            "enabled": self.enabled,
+            "seconds": round(self._seconds, 3) if self._seconds is not None else None,
+            "steps": steps,
+            "pending": [
+                name
+                for name, _ in self._steps
+                if name in self.selected and name not in steps
+            ],
+        }
+
+    def stats(self):
+        status = self.status()
+        return {
+            "ready": status["ready"],
+            "seconds": status["seconds"] or 0.0,
+            "failed_steps": sum(1 for r in status["steps"].values() if not r["ok"]),
+        }
@@ -0,0 +1,145 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# 最多快取幾個地點
+FORECAST_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "128"))
+# 設定後快取會寫入此 JSON 檔案，重啟後仍可使用
+FORECAST_CACHE_PATH = os.getenv("WEATHER_CACHE_PATH")
+# OpenWeather 5 天預報每 3 小時一個時段，也大約每 3 小時更新一次
+SLOT_SECONDS = 3 * 60 * 60
+DT_FORMAT = "%Y-%m-%d %H:%M:%S"
+_EPOCH = datetime(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_location(location):
+    """統一地點名稱的大小寫與空白，作為快取鍵"""
+    return " ".join(str(location).split()).lower()
+
+
+def _seconds(naive_datetime):
+    return (naive_datetime - _EPOCH).total_seconds()
+
+
+def next_slot_boundary(now=None):
+    """返回下一個 3 小時時段邊界（UTC）的 epoch 秒數"""
+    now = time.time() if now is None else now
+    return (int(now) // SLOT_SECONDS + 1) * SLOT_SECONDS
+
+
+class ForecastEntry:
+    """已解析並依時間排序的預報列表，以二分搜尋找出最接近的時段"""
+
+    def __init__(self, forecasts, expires_at):
+        pairs = sorted(
+            (
+                (_seconds(datetime.strptime(item["dt_txt"], DT_FORMAT)), item)
+                for item in forecasts
+            ),
+            key=lambda pair: pair[0],
+        )
+        self.times = [seconds for seconds, _ in pairs]
+        self.forecasts = [item for _, item in pairs]
+        self.expires_at = expires_at
+
+    def closest(self, target_datetime):
+        """返回與目標時間最接近的預報；距離相同時取較早的時段"""
+        target = _seconds(target_datetime)
+        i = bisect.bisect_left(self.times, target)
+        if i == 0:
+            return self.forecasts[0]
+        if i == len(self.times):
+            return self.forecasts[-1]
+        if self.times[i] - target < target - self.times[i - 1]:
+            return self.forecasts[i]
+        return self.forecasts[i - 1]
+
+
+class ForecastCache:
+    """依地點共用的預報快取
+
+    到期時間對齊 OpenWeather 的 3 小時更新時段，超過容量時淘汰最久未使用的地點。
+    """
+
+    def __init__(self, max_size=FORECAST_CACHE_SIZE, path=FORECAST_CACHE_PATH):
+        self.max_size = max_size
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._load()
+
+    def get(self, location):
+        """返回未過期的 ForecastEntry，沒有則返回 None"""
+        key = normalize_location(location)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, location, forecasts):
+        """保存 /forecast 回應中的 list，並返回解析後的 ForecastEntry"""
+        entry = ForecastEntry(forecasts, next_slot_boundary())
+        with self._lock:
+            self._entries[normalize_location(location)] = entry
+            self._entries.move_to_end(normalize_location(location))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        self._save()
+        return entry
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        return stats
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取天氣快取失敗: {e}")
+            return
+        now = time.time()
+        for key, value in data.items():
+            if value["expires_at"] > now:
+                self._entries[key] = ForecastEntry(
+                    value["forecasts"], value["expires_at"]
+                )
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                key: {"expires_at": entry.expires_at, "forecasts": entry.forecasts}
+                for key, entry in self._entries.items()
+            }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+                json.dump(data, cache_file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"寫入天氣快取失敗: {e}")
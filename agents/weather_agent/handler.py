@@ -1,24 +1,42 @@
 import requests
 from deep_translator import GoogleTranslator
-from langchain import OpenAI
 import os
 from dotenv import load_dotenv
 import logging
+import contextvars
+import queue
+import threading
 from datetime import datetime
+from agents.tools.backends import backend_slot, backend_timeout
+from agents.tools.clients import get_http_session, get_llm
+from agents.tools.singleflight import get_group
+from agents.tools.structured_output import complete_json
+from agents.weather_agent.forecast_cache import ForecastCache, normalize_location
+from agents.weather_agent.locations import LocationDirectory
+from agents.weather_agent.templates import render_weather_reply
+from models import weather_query_adapter
 
 load_dotenv()
 
 # 環境變數和 API 配置
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
-OPENWEATHER_FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+OPENWEATHER_FORECAST_URL = os.getenv(
+    "OPENWEATHER_FORECAST_URL", "https://api.openweathermap.org/data/2.5/forecast"
+)
+# 設為 1 時以 LLM 潤飾天氣回覆，預設以本地範本產生（請求中的 llm_reply 可覆寫）
+WEATHER_LLM_REPLY = os.getenv("WEATHER_LLM_REPLY", "0") == "1"
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
 
+# 各地點共用的預報快取
+forecast_cache = ForecastCache()
+# 快取未命中時，同一地點的並行查詢只送出一次 /forecast
+forecast_flight = get_group("openweather.forecast")
+
 
 def parse_weather_query(query):
     """Parse natural language weather query into structured data."""
-    llm = OpenAI(temperature=0.7)
     prompt = f"""
     你是一個貼心的天氣助手，專門幫助用戶解析天氣相關的問題。
     用戶的輸入是: "{query}"。
@@ -27,14 +45,12 @@ def parse_weather_query(query):
         "location": "<地點名稱>",
         "datetime": "<目標時間 (YYYY-MM-DD HH:MM:SS)>"
     }}
-    如果未指定時間，請設置為當前時間。
+    如果未指定時間，請設置為當前時間（現在是 {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}）。
     """
-    response = llm.generate(prompts=[prompt])
     try:
-        parsed_data = eval(response.generations[0][0].text.strip())
+        parsed_data = complete_json(prompt, weather_query_adapter).model_dump()
         # 處理簡單的日期和時間修正（例如 1/24 下午3點）
-        if "datetime" in parsed_data:
-            parsed_data["datetime"] = normalize_datetime(parsed_data["datetime"])
+        parsed_data["datetime"] = normalize_datetime(parsed_data["datetime"] or "")
         return parsed_data
     except Exception as e:
         logging.error(f"解析自然語言失敗: {e}")
@@ -46,6 +62,12 @@ def parse_weather_query(query):
 
 def normalize_datetime(raw_datetime):
     """Normalize raw datetime from LLM to standard format."""
+    try:
+        # 標準格式或 ISO 8601（上游解析的結果）
+        parsed = datetime.fromisoformat(raw_datetime.replace("Z", "+00:00"))
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        pass
     try:
         # 自然語言格式（例如 "1/24 下午3點"）轉換成標準時間
         if "下午" in raw_datetime or "上午" in raw_datetime:
@@ -61,39 +83,46 @@ def normalize_datetime(raw_datetime):
 def translate_location(location):
     """將地點名稱從繁體中文翻譯為英文。"""
     try:
-        return GoogleTranslator(source="zh-TW", target="en").translate(location)
+        with backend_slot("translator"):
+            return GoogleTranslator(source="zh-TW", target="en").translate(location)
     except Exception as e:
         logging.warning(f"地點翻譯失敗，使用原始地點名稱: {location}，錯誤: {e}")
         return location  # 如果翻譯失敗，返回原始地點
 
 
+# 地點名稱對照表，常見地點直接對應到經緯度，不必每次翻譯
+location_directory = LocationDirectory(translate_location)
+
+
 def fetch_weather_forecast(location, target_date):
-    """Fetch weather forecast for a specific date and time."""
+    """Fetch weather forecast for a specific date and time.
+
+    location 可以是地點名稱，或 location_directory.resolve() 返回的字典；
+    有經緯度時以 lat/lon 查詢，避免同名地點的歧義。
+    """
     try:
-        response = requests.get(
-            OPENWEATHER_FORECAST_URL,
-            params={
-                "q": location,
-                "appid": OPENWEATHER_API_KEY,
-                "units": "metric",
-                "lang": "zh_tw",
-            },
-        )
-        response.raise_for_status()
-        forecast_data = response.json()
+        if isinstance(location, dict):
+            cache_key = location["name"]
+            if "lat" in location and "lon" in location:
+                query = {"lat": location["lat"], "lon": location["lon"]}
+            else:
+                query = {"q": location["name"]}
+        else:
+            cache_key = location
+            query = {"q": location}
+
+        entry = forecast_cache.get(cache_key)
+        if entry is None:
+            entry = forecast_flight.do(
+                normalize_location(cache_key),
+                lambda: _download_forecast(cache_key, query),
+            )
 
         # 解析目標日期
         target_datetime = datetime.strptime(target_date, "%Y-%m-%d %H:%M:%S")
 
-        # 查找與目標時間最接近的預報
-        closest_forecast = min(
-            forecast_data["list"],
-            key=lambda x: abs(
-                datetime.strptime(x["dt_txt"], "%Y-%m-%d %H:%M:%S") - target_datetime
-            ),
-        )
-
-        return closest_forecast
+        # 查找與目標時間最接近的預報（已排序，二分搜尋）
+        return entry.closest(target_datetime)
     except requests.exceptions.RequestException as e:
         logging.error(f"天氣預報 API 請求失敗: {e}")
         return {"error": f"無法獲取天氣預報資訊: {e}"}
@@ -102,10 +131,29 @@ def fetch_weather_forecast(location, target_date):
         return {"error": "天氣數據解析失敗"}
 
 
-def generate_weather_response(query, weather_data):
-    """使用 LLM 生成自然語言天氣回覆。"""
-    llm = OpenAI(temperature=0.7)
-    prompt = f"""
+def _download_forecast(cache_key, query):
+    """呼叫 /forecast 並寫入快取，返回 ForecastEntry"""
+    with backend_slot("openweather"):
+        response = get_http_session().get(
+            OPENWEATHER_FORECAST_URL,
+            params={
+                **query,
+                "appid": OPENWEATHER_API_KEY,
+                "units": "metric",
+                "lang": "zh_tw",
+            },
+            timeout=backend_timeout("openweather"),
+        )
+    response.raise_for_status()
+    forecast_data = response.json()
+    entry = forecast_cache.put(cache_key, forecast_data["list"])
+    if "q" in query:
+        location_directory.remember_coordinates(cache_key, forecast_data.get("city"))
+    return entry
+
+
+def weather_reply_prompt(query, weather_data):
+    return f"""
     你是一個貼心的天氣助手，用戶剛查詢天氣。
     查詢內容: "{query}"
     天氣數據: {weather_data}
@@ -114,10 +162,51 @@ def generate_weather_response(query, weather_data):
     - "台北今天多雲，氣溫約25°C，濕度為70%。"
     - "明天台中的天氣是晴朗，最高溫為30°C，最低溫為22°C。"
     """
-    response = llm.generate(prompts=[prompt])
+
+
+def generate_weather_response(query, weather_data):
+    """使用 LLM 生成自然語言天氣回覆。"""
+    llm = get_llm()
+    prompt = weather_reply_prompt(query, weather_data)
+    with backend_slot("openai"):
+        response = llm.generate(prompts=[prompt])
     return response.generations[0][0].text.strip()
 
 
+def stream_weather_response(query, weather_data):
+    """逐段產生 LLM 天氣回覆，每取得一段就 yield 一次
+
+    上游串流在背景執行緒中讀取並放入佇列，OpenAI 的並行名額只在讀取上游時佔用；
+    客戶端讀得慢或中途斷線都不會一直佔住名額。
+    """
+    prompt = weather_reply_prompt(query, weather_data)
+    chunks = queue.Queue()
+
+    def read_upstream():
+        try:
+            with backend_slot("openai"):
+                for chunk in get_llm().stream(prompt):
+                    # 文字補全模型返回字串，聊天模型返回帶 content 的訊息
+                    chunks.put((True, getattr(chunk, "content", chunk)))
+        except Exception as e:
+            chunks.put((False, e))
+        chunks.put((False, None))
+
+    # 帶上目前的 context，讓背景執行緒中的 span 記錄到同一個請求
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run, args=(read_upstream,), name="weather-stream", daemon=True
+    ).start()
+    while True:
+        ok, value = chunks.get()
+        if ok:
+            yield value
+        elif value is None:
+            return
+        else:
+            raise value
+
+
 def handle_weather_request(data):
     """
     Handle user weather queries with time-specific forecasts.
@@ -125,7 +214,9 @@ def handle_weather_request(data):
     處理用戶的天氣查詢，提供特定時間的天氣預報。
 
     Args:
-        data (dict): 包含用戶查詢的字典，應該包含 "query" 鍵。
+        data (dict): 包含用戶查詢的字典，應該包含 "query" 鍵；
+            若上游已解析出 "location"（與 "datetime"），則不再以 LLM 解析。
+            "llm_reply" 可指定是否以 LLM 潤飾回覆，預設依 WEATHER_LLM_REPLY。
 
     Returns:
         dict: 包含天氣回覆或錯誤信息的字典。
@@ -137,20 +228,42 @@ def handle_weather_request(data):
                 "error": "錯誤信息"
     """
     """Handle user weather queries with time-specific forecasts."""
+    weather_data = prepare_weather_data(data)
+    if "error" in weather_data:
+        return weather_data
+
+    # 第四步: 生成自然語言天氣回覆：預設套用範本，指定時才呼叫 LLM
+    if data.get("llm_reply", WEATHER_LLM_REPLY):
+        query = data.get("query") or weather_data["location"]
+        response = generate_weather_response(query, weather_data)
+    else:
+        response = render_weather_reply(weather_data)
+    return {"response": response}  # 返回回覆
+
+
+def prepare_weather_data(data):
+    """解析地點與時間並取得預報，返回回覆所需的天氣數據或 {"error": ...}"""
     query = data.get("query", "")
-    if not query:
+    if not query and not data.get("location"):
         return {"error": "請提供天氣查詢內容。"}
 
-    # 第一步: 解析自然語言查詢
-    parsed_data = parse_weather_query(query)
-    location = parsed_data["location"]
-    target_datetime = parsed_data["datetime"]
+    # 第一步: 解析自然語言查詢（上游已解析出地點時直接使用）
+    if data.get("location"):
+        location = data["location"]
+        if data.get("datetime"):
+            target_datetime = normalize_datetime(data["datetime"])
+        else:
+            target_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    else:
+        parsed_data = parse_weather_query(query)
+        location = parsed_data["location"]
+        target_datetime = parsed_data["datetime"]
 
-    # 第二步: 翻譯地點名稱
-    translated_location = translate_location(location)
+    # 第二步: 查詢地點對照表（未知地點才翻譯）
+    resolved_location = location_directory.resolve(location)
 
     # 第三步: 獲取天氣預報
-    forecast = fetch_weather_forecast(translated_location, target_datetime)
+    forecast = fetch_weather_forecast(resolved_location, target_datetime)
     if "error" in forecast:
         return forecast
 
@@ -160,15 +273,19 @@ def handle_weather_request(data):
     humidity = forecast["main"]["humidity"]
     forecast_time = forecast["dt_txt"]
 
-    # 第四步: 生成自然語言回覆
     # 構建天氣數據字典
-    weather_data = {
+    return {
         "location": location,  # 地點名稱
         "forecast_time": forecast_time,  # 預報時間
         "description": description,  # 天氣描述
         "temperature": temperature,  # 氣溫
         "humidity": humidity,  # 濕度
+        "pop": forecast.get("pop", 0),  # 降雨機率
+    }
+
+
+def agent_stats():
+    return {
+        "weather_forecasts": forecast_cache.stats(),
+        "weather_locations": location_directory.stats(),
     }
-    # 生成自然語言天氣回覆
-    response = generate_weather_response(query, weather_data)
-    return {"response": response}  # 返回回覆
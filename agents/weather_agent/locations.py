@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+# 新翻譯的地點會寫入此檔案，重啟後不必再呼叫翻譯
+LOCATIONS_PATH = os.getenv("WEATHER_LOCATIONS_PATH", "weather_locations.json")
+
+logger = logging.getLogger(__name__)
+
+# 台灣縣市與常見地區，直接對應到經緯度，查詢時不需翻譯
+SEED_LOCATIONS = {
+    "台北": {"name": "Taipei", "lat": 25.0330, "lon": 121.5654},
+    "新北": {"name": "New Taipei", "lat": 25.0120, "lon": 121.4650},
+    "基隆": {"name": "Keelung", "lat": 25.1276, "lon": 121.7392},
+    "桃園": {"name": "Taoyuan", "lat": 24.9936, "lon": 121.3010},
+    "新竹": {"name": "Hsinchu", "lat": 24.8138, "lon": 120.9675},
+    "苗栗": {"name": "Miaoli", "lat": 24.5602, "lon": 120.8214},
+    "台中": {"name": "Taichung", "lat": 24.1477, "lon": 120.6736},
+    "彰化": {"name": "Changhua", "lat": 24.0518, "lon": 120.5161},
+    "南投": {"name": "Nantou", "lat": 23.9609, "lon": 120.9719},
+    "雲林": {"name": "Yunlin", "lat": 23.7092, "lon": 120.5430},
+    "嘉義": {"name": "Chiayi", "lat": 23.4801, "lon": 120.4491},
+    "台南": {"name": "Tainan", "lat": 22.9999, "lon": 120.2270},
+    "高雄": {"name": "Kaohsiung", "lat": 22.6273, "lon": 120.3014},
+    "屏東": {"name": "Pingtung", "lat": 22.6690, "lon": 120.4862},
+    "宜蘭": {"name": "Yilan", "lat": 24.7570, "lon": 121.7530},
+    "花蓮": {"name": "Hualien", "lat": 23.9872, "lon": 121.6016},
+    "台東": {"name": "Taitung", "lat": 22.7583, "lon": 121.1444},
+    "澎湖": {"name": "Penghu", "lat": 23.5655, "lon": 119.5793},
+    "金門": {"name": "Kinmen", "lat": 24.4365, "lon": 118.3186},
+    "馬祖": {"name": "Matsu", "lat": 26.1597, "lon": 119.9495},
+    "連江": {"name": "Lienchiang", "lat": 26.1597, "lon": 119.9495},
+    "信義": {"name": "Xinyi", "lat": 25.0330, "lon": 121.5654},
+    "士林": {"name": "Shilin", "lat": 25.0930, "lon": 121.5250},
+    "北投": {"name": "Beitou", "lat": 25.1320, "lon": 121.5010},
+    "板橋": {"name": "Banqiao", "lat": 25.0143, "lon": 121.4672},
+    "淡水": {"name": "Tamsui", "lat": 25.1696, "lon": 121.4406},
+    "新店": {"name": "Xindian", "lat": 24.9676, "lon": 121.5418},
+    "九份": {"name": "Jiufen", "lat": 25.1090, "lon": 121.8440},
+    "中壢": {"name": "Zhongli", "lat": 24.9537, "lon": 121.2256},
+    "竹北": {"name": "Zhubei", "lat": 24.8390, "lon": 121.0040},
+    "鳳山": {"name": "Fengshan", "lat": 22.6269, "lon": 120.3591},
+    "羅東": {"name": "Luodong", "lat": 24.6770, "lon": 121.7660},
+    "日月潭": {"name": "Sun Moon Lake", "lat": 23.8570, "lon": 120.9150},
+    "阿里山": {"name": "Alishan", "lat": 23.5080, "lon": 120.8020},
+    "墾丁": {"name": "Kenting", "lat": 21.9450, "lon": 120.7990},
+}
+
+# 內建地點可接的行政區後綴：查不到時只在後綴與該地點的層級相符時去掉後綴再查，
+# 例如「信義區」對應台北的「信義」，南投的「信義鄉」則不會
+SEED_SUFFIXES = {
+    "台北": ("市",),
+    "新北": ("市",),
+    "基隆": ("市",),
+    "桃園": ("市",),
+    "新竹": ("市", "縣"),
+    "苗栗": ("縣", "市"),
+    "台中": ("市",),
+    "彰化": ("縣", "市"),
+    "南投": ("縣", "市"),
+    "雲林": ("縣",),
+    "嘉義": ("市", "縣"),
+    "台南": ("市",),
+    "高雄": ("市",),
+    "屏東": ("縣", "市"),
+    "宜蘭": ("縣", "市"),
+    "花蓮": ("縣", "市"),
+    "台東": ("縣", "市"),
+    "澎湖": ("縣",),
+    "金門": ("縣",),
+    "連江": ("縣",),
+    "信義": ("區",),
+    "士林": ("區",),
+    "北投": ("區",),
+    "板橋": ("區",),
+    "淡水": ("區",),
+    "新店": ("區",),
+    "中壢": ("區",),
+    "竹北": ("市",),
+    "鳳山": ("區",),
+    "羅東": ("鎮",),
+}
+
+
+def normalize_name(name):
+    """統一寫法：去除空白、臺 -> 台"""
+    return "".join(str(name).split()).replace("臺", "台")
+
+
+class LocationDirectory:
+    """地點名稱 -> 英文名稱 / 經緯度 的對照表
+
+    預先載入台灣縣市，其他地點第一次查詢時翻譯並保存到檔案。
+    """
+
+    def __init__(self, translate, path=LOCATIONS_PATH):
+        self._translate = translate
+        self.path = path
+        self._lock = threading.Lock()
+        self._locations = dict(SEED_LOCATIONS)
+        self._learned = {}
+        self._stats = {"hits": 0, "translations": 0}
+        self._load()
+
+    def lookup(self, name):
+        """只查對照表，不翻譯；找不到返回 None"""
+        name = normalize_name(name)
+        with self._lock:
+            if name in self._locations:
+                return self._locations[name]
+        base, suffix = name[:-1], name[-1:]
+        if suffix in SEED_SUFFIXES.get(base, ()):
+            return SEED_LOCATIONS[base]
+        return None
+
+    def resolve(self, name):
+        """返回 {"name": 英文名稱, "lat": 緯度, "lon": 經度}（經緯度可能沒有）"""
+        found = self.lookup(name)
+        if found is not None:
+            with self._lock:
+                self._stats["hits"] += 1
+            return found
+
+        location = {"name": self._translate(name)}
+        with self._lock:
+            self._stats["translations"] += 1
+        # 翻譯失敗時會返回原名，這種結果不保存，下次再試
+        if location["name"] == name and not name.isascii():
+            return location
+        with self._lock:
+            self._locations[normalize_name(name)] = location
+            self._learned[normalize_name(name)] = location
+        self._save()
+        return location
+
+    def remember_coordinates(self, english_name, city):
+        """以 /forecast 回應中的 city 資訊補上經緯度與城市 ID，之後直接以座標查詢"""
+        coord = (city or {}).get("coord")
+        if not coord:
+            return
+        updated = False
+        with self._lock:
+            for name, location in self._learned.items():
+                if location.get("name") == english_name and "lat" not in location:
+                    location = dict(
+                        location, lat=coord["lat"], lon=coord["lon"], id=city.get("id")
+                    )
+                    self._learned[name] = self._locations[name] = location
+                    updated = True
+        if updated:
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._locations)
+        return stats
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as locations_file:
+                learned = json.load(locations_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取地點對照表失敗: {e}")
+            return
+        self._learned.update(learned)
+        # 內建的縣市資料優先
+        for name, location in learned.items():
+            self._locations.setdefault(name, location)
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            learned = dict(self._learned)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".json")
+            with os.fdopen(fd, "w", encoding="utf-8") as locations_file:
+                json.dump(learned, locations_file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"寫入地點對照表失敗: {e}")
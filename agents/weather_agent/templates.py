@@ -0,0 +1,37 @@
+"""不經 LLM 的天氣回覆範本"""
+
+# (條件, 提醒)，依序檢查，符合的提醒都會加入回覆
+ADVICE_RULES = (
+    (lambda w: "雷" in w["description"], "可能有雷雨，盡量避免戶外活動。"),
+    (
+        lambda w: "雨" in w["description"] or w.get("pop", 0) >= 0.5,
+        "出門記得帶傘。",
+    ),
+    (lambda w: "雪" in w["description"], "可能下雪，注意路面濕滑。"),
+    (lambda w: w["temperature"] >= 30, "天氣炎熱，注意防曬並多補充水分。"),
+    (lambda w: w["temperature"] <= 15, "氣溫偏低，記得多穿一件外套保暖。"),
+    (lambda w: w["humidity"] >= 85, "濕度偏高，體感會比較悶熱潮濕。"),
+)
+# 沒有任何提醒時使用
+DEFAULT_ADVICE = "天氣穩定，適合外出。"
+
+
+def weather_advice(weather_data):
+    """依天氣數據返回提醒文字"""
+    advice = [text for matches, text in ADVICE_RULES if matches(weather_data)]
+    return "".join(advice) or DEFAULT_ADVICE
+
+
+def render_weather_reply(weather_data):
+    """以固定範本產生天氣回覆，例如：
+    台北 2024-01-24 15:00 的天氣為多雲，氣溫約 25°C，濕度 70%。天氣穩定，適合外出。
+    """
+    forecast_time = weather_data["forecast_time"][:16]
+    reply = (
+        f"{weather_data['location']} {forecast_time} 的天氣為"
+        f"{weather_data['description']}，氣溫約 {round(weather_data['temperature'])}°C，"
+        f"濕度 {weather_data['humidity']}%。"
+    )
+    if weather_data.get("pop"):
+        reply += f"降雨機率 {round(weather_data['pop'] * 100)}%。"
+    return reply + weather_advice(weather_data)
@@ -0,0 +1,423 @@
+"""離線壓測用的後端替身：Sheets、Calendar、OpenWeather 與 LLM
+
+每個替身都可設定延遲（秒），模擬真實服務的往返時間；資料都保存在記憶體中。
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Request:
+    """模擬 googleapiclient 的 HttpRequest：execute() 時才等待延遲並執行"""
+
+    def __init__(self, latency, fn):
+        self.latency = latency
+        self.fn = fn
+
+    def execute(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.fn()
+
+
+def _row_number(range_):
+    match = re.search(r"!A(\d+)", range_)
+    return int(match.group(1)) if match else None
+
+
+class FakeSheets:
+    """記憶體中的記帳工作表，支援 values().get / batchGet / append / batchUpdate
+    以及 spreadsheets().batchUpdate 的 updateCells 與 deleteDimension"""
+
+    def __init__(self, rows=None, latency=0.0):
+        self.rows = [list(row) for row in rows or [["日期", "分類", "金額", "描述"]]]
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return _SheetValues(self)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def apply_requests():
+            with self._lock:
+                for request in body.get("requests", []):
+                    if "updateCells" in request:
+                        update = request["updateCells"]
+                        cells = update["rows"][0]["values"]
+                        # userEnteredValue 為 {"numberValue": 1} 這類單一欄位
+                        self.rows[update["range"]["startRowIndex"]] = [
+                            next(iter(cell.get("userEnteredValue", {}).values()), "")
+                            for cell in cells
+                        ]
+                    else:
+                        range_ = request["deleteDimension"]["range"]
+                        del self.rows[range_["startIndex"] : range_["endIndex"]]
+            return {"replies": [{} for _ in body.get("requests", [])]}
+
+        return _Request(self.latency, apply_requests)
+
+
+class _SheetValues:
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def get(self, spreadsheetId, range):
+        def read():
+            with self.sheet._lock:
+                return {"values": [list(row) for row in self.sheet.rows]}
+
+        return _Request(self.sheet.latency, read)
+
+    def batchGet(self, spreadsheetId, ranges):
+        def read():
+            with self.sheet._lock:
+                value_ranges = []
+                for range_ in ranges:
+                    n = _row_number(range_)
+                    if n and n <= len(self.sheet.rows):
+                        value_ranges.append({"values": [list(self.sheet.rows[n - 1])]})
+                    else:
+                        value_ranges.append({})
+                return {"valueRanges": value_ranges}
+
+        return _Request(self.sheet.latency, read)
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def append_rows():
+            with self.sheet._lock:
+                start = len(self.sheet.rows) + 1
+                self.sheet.rows.extend(list(row) for row in body["values"])
+                end = len(self.sheet.rows)
+            return {
+                "updates": {
+                    "updatedRange": f"記帳!A{start}:D{end}",
+                    "updatedRows": end - start + 1,
+                    "updatedCells": 4 * (end - start + 1),
+                }
+            }
+
+        return _Request(self.sheet.latency, append_rows)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return self.batchUpdate(
+            spreadsheetId, {"data": [{"range": range, "values": body["values"]}]}
+        )
+
+    def batchUpdate(self, spreadsheetId, body):
+        def write_rows():
+            with self.sheet._lock:
+                for data in body["data"]:
+                    self.sheet.rows[_row_number(data["range"]) - 1] = list(
+                        data["values"][0]
+                    )
+            return {"totalUpdatedRows": len(body["data"])}
+
+        return _Request(self.sheet.latency, write_rows)
+
+
+class FakeCalendar:
+    """記憶體中的 primary 日曆，支援分頁、syncToken 與新增 / 更新 / 刪除"""
+
+    def __init__(self, events=(), latency=0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._events = {}
+        self._log = []  # (版本, 事件)，供 syncToken 增量查詢
+        self._version = 0
+        for event in events:
+            self._put(dict(event))
+
+    def _put(self, event, cancelled=False):
+        with self._lock:
+            event.setdefault("id", uuid.uuid4().hex[:12])
+            self._version += 1
+            if cancelled:
+                self._events.pop(event["id"], None)
+                event = {"id": event["id"], "status": "cancelled"}
+            else:
+                event.setdefault("status", "confirmed")
+                self._events[event["id"]] = event
+            self._log.append((self._version, event))
+            return dict(event)
+
+    def events(self):
+        return self
+
+    def list(
+        self,
+        calendarId,
+        maxResults=250,
+        pageToken=None,
+        syncToken=None,
+        timeMin=None,
+        timeMax=None,
+        **kwargs,
+    ):
+        def list_page():
+            with self._lock:
+                if syncToken is not None:
+                    items = [e for v, e in self._log if v > int(syncToken)]
+                else:
+                    items = list(self._events.values())
+                    if timeMin or timeMax:
+                        items = [e for e in items if _overlaps(e, timeMin, timeMax)]
+                version = self._version
+            offset = int(pageToken or 0)
+            response = {"items": items[offset : offset + maxResults]}
+            if offset + maxResults < len(items):
+                response["nextPageToken"] = str(offset + maxResults)
+            else:
+                response["nextSyncToken"] = str(version)
+            return response
+
+        return _Request(self.latency, list_page)
+
+    def insert(self, calendarId, body):
+        return _Request(
+            self.latency,
+            lambda: dict(self._put(dict(body)), htmlLink="https://calendar.local"),
+        )
+
+    def get(self, calendarId, eventId):
+        def get_event():
+            with self._lock:
+                return json.loads(json.dumps(self._events[eventId]))
+
+        return _Request(self.latency, get_event)
+
+    def update(self, calendarId, eventId, body):
+        return _Request(self.latency, lambda: self._put(dict(body, id=eventId)))
+
+    def delete(self, calendarId, eventId):
+        return _Request(
+            self.latency, lambda: self._put({"id": eventId}, cancelled=True) and ""
+        )
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _overlaps(event, time_min, time_max):
+    start = _parse_time(event["start"]["dateTime"])
+    end = _parse_time(event["end"]["dateTime"])
+    if time_min and end <= _parse_time(time_min):
+        return False
+    if time_max and start >= _parse_time(time_max):
+        return False
+    return True
+
+
+def sample_events(days=30, per_day=4, tz="+08:00"):
+    """產生從今天起每天數個一小時的事件"""
+    today = datetime.now().date()
+    events = []
+    for day in range(days):
+        date = today + timedelta(days=day)
+        for i in range(per_day):
+            hour = 9 + i * 2
+            events.append(
+                {
+                    "summary": f"會議 {day}-{i}",
+                    "start": {
+                        "dateTime": f"{date}T{hour:02d}:00:00{tz}",
+                        "timeZone": "Asia/Taipei",
+                    },
+                    "end": {
+                        "dateTime": f"{date}T{hour + 1:02d}:00:00{tz}",
+                        "timeZone": "Asia/Taipei",
+                    },
+                }
+            )
+    return events
+
+
+def sample_ledger(days=90, per_day=3):
+    """產生過去數天的記帳資料（含標題列）"""
+    today = datetime.now().date()
+    categories = ("餐飲", "交通", "購物")
+    rows = [["日期", "分類", "金額", "描述"]]
+    for day in range(days):
+        date = today - timedelta(days=day)
+        for i in range(per_day):
+            rows.append([date.isoformat(), categories[i % 3], str(50 + i * 10), ""])
+    return rows
+
+
+class FakeOpenWeather:
+    """在背景執行緒提供 /forecast 的本地 HTTP 伺服器"""
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                body = json.dumps(fake.forecast()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/forecast"
+
+    @staticmethod
+    def forecast():
+        """5 天、每 3 小時一筆的預報"""
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        start = now - timedelta(hours=now.hour % 3)
+        items = []
+        for i in range(40):
+            slot = start + timedelta(hours=3 * i)
+            items.append(
+                {
+                    "dt_txt": slot.strftime("%Y-%m-%d %H:%M:%S"),
+                    "main": {"temp": 20 + i % 10, "humidity": 60 + i % 30},
+                    "weather": [{"description": ("晴", "多雲", "小雨")[i % 3]}],
+                    "pop": (i % 3) / 3,
+                }
+            )
+        return {
+            "city": {"id": 1668341, "coord": {"lat": 25.04, "lon": 121.56}},
+            "list": items,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-openweather", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class _Generation:
+    def __init__(self, text):
+        self.text = text
+
+
+class _LLMResult:
+    def __init__(self, texts):
+        self.generations = [[_Generation(text)] for text in texts]
+
+
+# (輸入中的關鍵字, 回應的結構化請求)，依序比對
+CANNED_REQUESTS = (
+    (
+        "天氣",
+        {
+            "agent_type": "weather",
+            "command": "query",
+            "parameters": {"location": "台北"},
+        },
+    ),
+    (
+        "行程",
+        {
+            "agent_type": "calendar",
+            "command": "query",
+            "parameters": {
+                "time_min": "{today}T00:00:00+08:00",
+                "time_max": "{today}T23:59:59+08:00",
+            },
+        },
+    ),
+)
+DEFAULT_REQUEST = {
+    "agent_type": "accounting",
+    "command": "query",
+    "parameters": {"date_range": ["{month_start}", "{today}"]},
+}
+
+
+class FakeLLM:
+    """回應固定內容的 LLM，同時提供文字補全（__call__ / generate / stream）
+    與聊天模型（invoke）的介面"""
+
+    def __init__(self, latency=0.0, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _canned(user_input):
+        template = next(
+            (request for keyword, request in CANNED_REQUESTS if keyword in user_input),
+            DEFAULT_REQUEST,
+        )
+        today = datetime.now().date()
+        text = json.dumps(template, ensure_ascii=False)
+        text = text.replace("{today}", today.isoformat())
+        text = text.replace("{month_start}", today.replace(day=1).isoformat())
+        return json.loads(text)
+
+    def invoke(self, prompt):
+        self._wait()
+        if '{"requests"' in prompt:
+            inputs = re.findall(r'^\d+\. "(.*)"$', prompt, re.MULTILINE)
+            content = {"requests": [self._canned(text) for text in inputs]}
+        elif "請提取地點名稱" in prompt:
+            content = {
+                "location": "台北",
+                "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+        else:
+            match = re.search(r'用戶輸入: "(.*)"', prompt)
+            content = self._canned(match.group(1) if match else "")
+        return _Message(json.dumps(content, ensure_ascii=False))
+
+    def _reply(self):
+        return "今天天氣不錯，氣溫舒適，適合外出。"
+
+    def __call__(self, prompt):
+        self._wait()
+        return self._reply()
+
+    def generate(self, prompts):
+        self._wait()
+        return _LLMResult([self._reply() for _ in prompts])
+
+    def stream(self, prompt):
+        self._wait()
+        for token in re.findall(r".{1,4}", self._reply()):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
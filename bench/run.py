@@ -0,0 +1,263 @@
+"""離線壓測：以本地替身取代所有外部服務，量測 /api/life-assistant 的延遲與吞吐量
+
+用法:
+    python -m bench.run --requests 500 --concurrency 32 --json bench_result.json
+    python -m bench.run --llm-latency 0.8 --env CALENDAR_EVENT_CACHE=0
+
+各 (agent, command) 分別統計 p50 / p95 / p99 延遲與每秒請求數。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# (標籤, 請求主體)；依序輪流送出
+SCENARIOS = {
+    "weather.query.nl": {"natural_language": True, "query": "明天台北天氣如何"},
+    "weather.query": {
+        "agent_type": "weather",
+        "command": "query",
+        "parameters": {"location": "高雄"},
+    },
+    "calendar.query": {
+        "agent_type": "calendar",
+        "command": "query",
+        "parameters": {
+            "time_min": "{today}T00:00:00+08:00",
+            "time_max": "{week}T00:00:00+08:00",
+        },
+    },
+    "calendar.free_busy": {
+        "agent_type": "calendar",
+        "command": "free_busy",
+        "parameters": {
+            "time_min": "{today}T08:00:00+08:00",
+            "time_max": "{today}T20:00:00+08:00",
+        },
+    },
+    "accounting.query": {
+        "agent_type": "accounting",
+        "command": "query",
+        "parameters": {"date_range": ["{month_start}", "{today}"], "category": "餐飲"},
+    },
+    "accounting.add": {
+        "agent_type": "accounting",
+        "command": "add",
+        "parameters": {"date": "{today}", "category": "餐飲", "amount": 100},
+    },
+    "accounting.query.nl": {
+        "natural_language": True,
+        "query": "幫我整理一下最近的開銷",
+    },
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="離線壓測 /api/life-assistant")
+    parser.add_argument("--requests", type=int, default=300, help="總請求數")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時進行的請求數")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="只執行指定的情境（可重複），預設全部",
+    )
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--sheets-latency", type=float, default=0.15)
+    parser.add_argument("--calendar-latency", type=float, default=0.15)
+    parser.add_argument("--weather-latency", type=float, default=0.1)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="載入 server 前設定的環境變數，例如 CALENDAR_EVENT_CACHE=0",
+    )
+    parser.add_argument("--json", dest="json_path", help="將結果寫入 JSON 檔案")
+    return parser.parse_args(argv)
+
+
+def percentile(sorted_values, p):
+    """最近排名法的百分位數"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, wall_seconds):
+    """samples: [(標籤, 秒數, 是否成功)]，返回各標籤與整體的統計"""
+    groups = {}
+    for label, seconds, ok in samples:
+        groups.setdefault(label, []).append((seconds, ok))
+    groups["all"] = [(seconds, ok) for _, seconds, ok in samples]
+
+    summary = {}
+    for label, values in groups.items():
+        latencies = sorted(seconds * 1000 for seconds, _ in values)
+        summary[label] = {
+            "requests": len(values),
+            "errors": sum(1 for _, ok in values if not ok),
+            "rps": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(latencies[-1], 2),
+        }
+    return summary
+
+
+def render_body(body):
+    today = datetime.now().date()
+    text = json.dumps(body, ensure_ascii=False)
+    text = text.replace("{today}", today.isoformat())
+    text = text.replace("{month_start}", today.replace(day=1).isoformat())
+    text = text.replace("{week}", (today + timedelta(days=7)).isoformat())
+    return json.loads(text)
+
+
+def install_fakes(args):
+    """建立替身並注入 server 使用的各個客戶端，返回 (server 模組, 替身)"""
+    from bench.fakes import (
+        FakeCalendar,
+        FakeLLM,
+        FakeOpenWeather,
+        FakeSheets,
+        sample_events,
+        sample_ledger,
+    )
+
+    weather = FakeOpenWeather(latency=args.weather_latency).start()
+    os.environ["OPENWEATHER_FORECAST_URL"] = weather.url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("OPENWEATHER_API_KEY", "bench")
+    # 壓測不應改寫工作目錄中的地點對照表與記帳日誌
+    os.environ.setdefault("WEATHER_LOCATIONS_PATH", "")
+    os.environ.setdefault(
+        "ACCOUNTING_JOURNAL_PATH",
+        os.path.join(tempfile.mkdtemp(prefix="bench-"), "journal.jsonl"),
+    )
+
+    import server
+    from agents.tools.client_pool import set_service_override
+
+    fakes = {
+        "llm": FakeLLM(latency=args.llm_latency),
+        "sheets": FakeSheets(sample_ledger(), latency=args.sheets_latency),
+        "calendar": FakeCalendar(sample_events(), latency=args.calendar_latency),
+        "openweather": weather,
+    }
+    server.clients.set_llm(fakes["llm"])
+    server.clients.set_json_llm(fakes["llm"])
+    set_service_override("sheets", fakes["sheets"])
+    set_service_override("calendar", fakes["calendar"])
+    return server, fakes
+
+
+async def drive(app, bodies, total, concurrency):
+    """以固定並行數送出請求，返回 ([(標籤, 秒數, 是否成功)], 總耗時)"""
+    import httpx
+
+    samples = []
+    counter = iter(range(total))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+
+        async def worker():
+            for i in counter:
+                label, body = bodies[i % len(bodies)]
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/api/life-assistant", json=body)
+                    result = response.json()
+                    ok = response.status_code == 200 and not (
+                        isinstance(result, dict) and "error" in result
+                    )
+                except Exception:
+                    ok = False
+                samples.append((label, time.perf_counter() - started, ok))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return samples, wall
+
+
+def print_summary(summary):
+    header = (
+        f"{'scenario':<22}{'req':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for label, stats in sorted(summary.items(), key=lambda item: item[0] == "all"):
+        print(
+            f"{label:<22}{stats['requests']:>6}{stats['errors']:>5}{stats['rps']:>9}"
+            f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+        )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    server, fakes = install_fakes(args)
+    # 先載入所有 agent，載入時間不計入延遲
+    server.agent_registry.load_all()
+
+    labels = args.scenario or list(SCENARIOS)
+    bodies = [(label, render_body(SCENARIOS[label])) for label in labels]
+    try:
+        samples, wall = asyncio.run(
+            drive(server.app, bodies, args.requests, args.concurrency)
+        )
+    finally:
+        server.agent_registry.stop()
+        fakes["openweather"].stop()
+
+    summary = summarize(samples, wall)
+    print_summary(summary)
+    print(
+        f"\n{len(samples)} requests in {wall:.2f}s, LLM calls: {fakes['llm'].calls}, "
+        f"OpenWeather requests: {fakes['openweather'].requests}"
+    )
+
+    if args.json_path:
+        result = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "scenarios": labels,
+                "latency": {
+                    "llm": args.llm_latency,
+                    "sheets": args.sheets_latency,
+                    "calendar": args.calendar_latency,
+                    "openweather": args.weather_latency,
+                },
+                "env": args.env,
+            },
+            "wall_seconds": round(wall, 3),
+            "results": summary,
+            "backend_calls": {
+                "llm": fakes["llm"].calls,
+                "openweather": fakes["openweather"].requests,
+            },
+            "stats": server.collect_stats(),
+        }
+        with open(args.json_path, "w", encoding="utf-8") as result_file:
+            json.dump(result, result_file, ensure_ascii=False, indent=2, default=str)
+    return 0 if all(ok for _, _, ok in samples) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
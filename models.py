@@ -1,7 +1,80 @@
 from  pydantic import BaseModel
-from typing import Optional
+from typing import List, Literal, Optional, Union
+from pydantic import ConfigDict, TypeAdapter, model_validator
 import json
 
 class prompt(BaseModel):
     role: str
-    message: str
\ No newline at end of file
+    message: str
+
+
+# 以下模型用於驗證 LLM 產生的結構化請求；未使用的欄位返回 None，輸出時會略去
+class AccountingParameters(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    date: Optional[str] = None
+    category: Optional[str] = None
+    amount: Optional[Union[int, float]] = None
+    description: Optional[str] = None
+    date_range: Optional[List[str]] = None
+    operations: Optional[List[dict]] = None
+
+
+class CalendarParameters(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    summary: Optional[str] = None
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+    timezone: Optional[str] = None
+    time_min: Optional[str] = None
+    time_max: Optional[str] = None
+    time: Optional[str] = None
+    event_id: Optional[str] = None
+
+
+class WeatherParameters(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    query: Optional[str] = None
+    location: Optional[str] = None
+    datetime: Optional[str] = None
+
+
+PARAMETER_MODELS = {
+    "accounting": AccountingParameters,
+    "calendar": CalendarParameters,
+    "weather": WeatherParameters,
+}
+
+
+class ApiRequest(BaseModel):
+    agent_type: Literal["accounting", "calendar", "weather"]
+    command: Literal[
+        "query", "add", "update", "delete", "bulk", "free_busy", "conflicts"
+    ]
+    parameters: dict = {}
+
+    @model_validator(mode="after")
+    def _validate_parameters(self):
+        model = PARAMETER_MODELS[self.agent_type]
+        self.parameters = model.model_validate(self.parameters).model_dump(
+            exclude_none=True
+        )
+        return self
+
+
+class BatchApiRequests(BaseModel):
+    # 各項另外以 ApiRequest 驗證，單項失敗不影響其他項
+    requests: List[dict]
+
+
+class WeatherQuery(BaseModel):
+    location: str = "台北"
+    datetime: Optional[str] = None
+
+
+# 預先建立的驗證器，避免每次請求重新建構
+api_request_adapter = TypeAdapter(ApiRequest)
+batch_requests_adapter = TypeAdapter(BatchApiRequests)
+weather_query_adapter = TypeAdapter(WeatherQuery)
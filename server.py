@@ -1,11 +1,40 @@
+import asyncio
+import contextvars
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
 from fastapi import FastAPI, HTTPException, Request
-from langchain.prompts import PromptTemplate
-from langchain_openai import OpenAI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
-from agents.accounting_agent.handler import handle_command as handle_accounting
-from agents.calendar_agent.handler import handle_command_calendar, find_event_id
-from agents.weather_agent.handler import handle_weather_request
+from agents.registry import agent_registry
+from agents.weather_agent.templates import render_weather_reply
+from agents.weather_agent.locations import SEED_LOCATIONS
+from agents.tools.backends import backend_stats
+from agents.tools.client_pool import load_discovery_documents, pool_stats
+from agents.tools.client_pool import prebuild_services
+from agents.tools.clients import clients
+from agents.tools.parse_cache import TIMEZONE, ParseCache
+from agents.tools.rule_parser import RULE_PARSER_ENABLED, RuleParser
+from agents.tools.singleflight import singleflight_stats
+from agents.tools.tracing import (
+    SERVER_TIMING_ENABLED,
+    TRACING_ENABLED,
+    end_trace,
+    record_agent_request,
+    record_http_request,
+    render_metrics,
+    span,
+    start_trace,
+)
+from agents.tools.structured_output import complete_json, structured_output_stats
+from agents.tools.token_handler import credential_manager
+from agents.tools.warmup import Warmup
+from models import api_request_adapter, batch_requests_adapter
+from utils.module_handler import loader_stats
 
 # 加載 .env 檔案中的環境變數
 load_dotenv()
@@ -14,21 +43,78 @@ load_dotenv()
 if not os.getenv("OPENAI_API_KEY"):
     raise EnvironmentError("未找到 OPENAI_API_KEY，請確認 .env 文件設置是否正確！")
 
-app = FastAPI()
 
-# 初始化 LangChain LLM
-llm = OpenAI(temperature=0.7)
+@asynccontextmanager
+async def lifespan(app):
+    # 啟動時載入 Google 憑證，之後由背景執行緒在到期前刷新
+    credential_manager.start()
+    # 其餘資源在背景預熱；停用時各項資源於第一次使用時才建立
+    warmup.start()
+    try:
+        yield
+    finally:
+        credential_manager.stop()
+        clients.close()
+        agent_registry.stop()
+        executor.shutdown(wait=False)
 
-prompt_template = PromptTemplate(
-    input_variables=["user_input"],
-    template="""
-你是一個專業的 API 輔助助手，將用戶輸入的自然語言解析為結構化 API 請求。
-用戶輸入: "{user_input}"
 
-生成 JSON：
-{{
+app = FastAPI(lifespan=lifespan)
+
+# 阻塞式的 LLM 解析與 agent 處理都在有上限的執行緒池中執行，不佔用事件迴圈
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "32"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+executor = ThreadPoolExecutor(max_workers=DISPATCH_WORKERS, thread_name_prefix="agent")
+# 預熱時預先建立 keep-alive 連線的網址（逗號分隔）
+WARMUP_PRECONNECT_URLS = [
+    url.strip()
+    for url in os.getenv(
+        "WARMUP_PRECONNECT_URLS", "https://api.openweathermap.org/"
+    ).split(",")
+    if url.strip()
+]
+# 預熱完成前 /healthz/ready 返回 503，部署時以此決定何時開始導入流量
+warmup = Warmup()
+
+
+@warmup.step("discovery")
+def warm_discovery_documents():
+    # 讀取離線的 discovery 文件，之後建構 Google 客戶端不需連網
+    return load_discovery_documents()
+
+
+@warmup.step("clients")
+def warm_clients():
+    # 建立共用的 HTTP 連線池與 LLM 客戶端（會載入 langchain）
+    clients.start()
+
+
+@warmup.step("agents")
+def warm_agents():
+    agent_registry.load_all()
+    return {name: stats["loaded"] for name, stats in agent_registry.stats().items()}
+
+
+@warmup.step("google")
+def warm_google_services():
+    """為每個工作執行緒預先建立一份 Sheets 與 Calendar 客戶端
+
+    客戶端放在備用池中，工作執行緒第一次呼叫 Google API 時取走一份，
+    不必在請求路徑上建構；用不到 Google 的請求也不會被拖慢。
+    """
+    return prebuild_services(DISPATCH_WORKERS)
+
+
+@warmup.step("connections")
+def warm_connections():
+    return clients.preconnect(WARMUP_PRECONNECT_URLS)
+
+
+# 結構化請求的格式說明，單筆與批次解析共用（大括號已跳脫，供 str.format 使用）
+REQUEST_SCHEMA = """{{
     "agent_type": "<accounting|calendar|weather>",
-    "command": "<query|add|update|delete>",
+    "command": "<query|add|update|delete|free_busy|conflicts>",
     "parameters": {{
         "summary": "<事件主題>",
         "start_time": "<開始時間 (ISO 8601)>",
@@ -36,61 +122,423 @@ prompt_template = PromptTemplate(
         "timezone": "Asia/Taipei"
     }}
 }}
-""",
-)
+各 agent 的 parameters 欄位：
+- accounting: date (YYYY-MM-DD), category, amount, description, date_range ([開始日期, 結束日期])
+- calendar: summary, start_time, end_time, time_min, time_max, time, timezone
+- weather: location, datetime (YYYY-MM-DD HH:MM:SS)
+"""
 
+# 以 str.format 填入，伺服器啟動時不必載入 langchain
+prompt_template = """
+你是一個專業的 API 輔助助手，將用戶輸入的自然語言解析為結構化 API 請求。
+現在時間: {now}（Asia/Taipei）
+用戶輸入: "{user_input}"
 
-# 自然語言解析函數
-def parse_user_input_to_api_request(user_input):
-    try:
-        response = llm(prompt_template.format(user_input=user_input))
-        parsed_data = eval(response)
+只輸出一個 JSON 物件，不要加任何說明文字：
+""" + REQUEST_SCHEMA
 
-        # 如果是刪除事件，必須查詢 `event_id`
-        if parsed_data["command"] == "delete":
-            # 執行查詢，找到匹配的事件 ID
-            event_id = find_event_id(
+batch_prompt_template = """
+你是一個專業的 API 輔助助手，將用戶輸入的自然語言解析為結構化 API 請求。
+現在時間: {now}（Asia/Taipei）
+以下共有 {count} 個獨立的用戶輸入，請逐一解析：
+{user_inputs}
+
+只輸出一個 JSON 物件，不要加任何說明文字，格式為
+{{"requests": [<依輸入順序，每個輸入一個物件>]}}
+每個物件的格式：
+""" + REQUEST_SCHEMA
+
+# 批次端點一次最多接受的請求數
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+
+
+# 自然語言解析結果快取，重複的說法不必再呼叫 LLM
+parse_cache = ParseCache()
+# 關鍵字規則解析，明確的輸入不必呼叫 LLM
+rule_parser = RuleParser(locations=SEED_LOCATIONS)
+
+
+def llm_parse(user_input, now):
+    """以 JSON 模式呼叫 LLM 將自然語言解析為結構化請求，並以 pydantic 模型驗證"""
+    prompt = prompt_template.format(
+        user_input=user_input, now=now.strftime("%Y-%m-%d %H:%M")
+    )
+    with span("parse.llm"):
+        return complete_json(prompt, api_request_adapter).model_dump()
+
+
+def llm_parse_batch(user_inputs, now):
+    """以一次 LLM 呼叫解析多個輸入，返回與輸入順序相同的結果（無法驗證的項目為 error）"""
+    numbered = "\n".join(f'{i + 1}. "{text}"' for i, text in enumerate(user_inputs))
+    prompt = batch_prompt_template.format(
+        user_inputs=numbered,
+        count=len(user_inputs),
+        now=now.strftime("%Y-%m-%d %H:%M"),
+    )
+    with span("parse.llm_batch"):
+        items = complete_json(prompt, batch_requests_adapter).requests
+    results = []
+    for i in range(len(user_inputs)):
+        if i >= len(items):
+            results.append({"error": "解析失敗: LLM 未返回此項結果"})
+            continue
+        try:
+            results.append(api_request_adapter.validate_python(items[i]).model_dump())
+        except ValueError as e:
+            results.append({"error": f"解析失敗: {str(e)}"})
+    return results
+
+
+def quick_parse(user_input):
+    """不呼叫 LLM 的解析：先以規則解析，再查快取；都沒有時返回 None"""
+    if RULE_PARSER_ENABLED:
+        with span("parse.rule"):
+            parsed_data, _, _ = rule_parser.parse(user_input)
+        if parsed_data is not None:
+            return parsed_data
+    with span("parse.cache"):
+        return parse_cache.get(user_input)
+
+
+def finalize_request(user_input, parsed_data):
+    """補上 agent 需要但解析結果沒有的參數"""
+    if parsed_data["agent_type"] == "weather":
+        # 保留原始問題，供天氣 agent 在缺少地點或以 LLM 潤飾回覆時使用
+        parsed_data["parameters"].setdefault("query", user_input)
+
+    # 如果是刪除事件，必須查詢 `event_id`
+    if parsed_data["agent_type"] == "calendar" and parsed_data["command"] == "delete":
+        # 執行查詢，找到匹配的事件 ID
+        with span("parse.event_lookup"):
+            calendar = agent_registry.load("calendar")
+            event_id = calendar.find_event_id(
                 summary=parsed_data["parameters"].get("summary"),
                 start_time=parsed_data["parameters"].get("start_time"),
                 end_time=parsed_data["parameters"].get("end_time"),
             )
-            if event_id:
-                parsed_data["parameters"]["event_id"] = event_id
-            else:
-                return {"error": "未找到匹配的事件，無法刪除"}
+        if event_id:
+            parsed_data["parameters"]["event_id"] = event_id
+        else:
+            return {"error": "未找到匹配的事件，無法刪除"}
+
+    return parsed_data
 
-        return parsed_data
+
+# 自然語言解析函數
+def parse_user_input_to_api_request(user_input):
+    try:
+        parsed_data = quick_parse(user_input)
+        if parsed_data is None:
+            # 提示中的現在時間與快取分桶使用同一個時間點
+            now = datetime.now(TIMEZONE)
+            parsed_data = llm_parse(user_input, now)
+            parse_cache.put(user_input, parsed_data, now)
+        return finalize_request(user_input, parsed_data)
     except Exception as e:
         return {"error": f"解析失敗: {str(e)}"}
 
 
+def parse_batch(user_inputs):
+    """批次解析：規則與快取能處理的先處理，其餘合併為一次 LLM 呼叫"""
+    results = [None] * len(user_inputs)
+    pending = []
+    for i, user_input in enumerate(user_inputs):
+        try:
+            results[i] = quick_parse(user_input)
+        except Exception as e:
+            results[i] = {"error": f"解析失敗: {str(e)}"}
+        if results[i] is None:
+            pending.append(i)
+
+    if pending:
+        now = datetime.now(TIMEZONE)
+        try:
+            parsed = llm_parse_batch([user_inputs[i] for i in pending], now)
+        except Exception as e:
+            parsed = [{"error": f"解析失敗: {str(e)}"}] * len(pending)
+        for i, parsed_data in zip(pending, parsed):
+            if "error" not in parsed_data:
+                parse_cache.put(user_inputs[i], parsed_data, now)
+            results[i] = parsed_data
+
+    for i, parsed_data in enumerate(results):
+        if "error" in parsed_data:
+            continue
+        try:
+            results[i] = finalize_request(user_inputs[i], parsed_data)
+        except Exception as e:
+            results[i] = {"error": f"解析失敗: {str(e)}"}
+    return results
+
+
+def dispatch_request(structured_request):
+    """依 agent_type 呼叫對應的 agent（阻塞式，於執行緒池中執行），並記錄延遲與錯誤"""
+    agent_type = structured_request.get("agent_type")
+    command = structured_request.get("command")
+    parameters = structured_request.get("parameters", {})
+
+    started = time.perf_counter()
+    failed = True
+    agent = agent_registry.get(agent_type)
+    try:
+        if agent is None:
+            raise HTTPException(status_code=400, detail="Unknown agent type")
+        with span(f"agent.{agent_type}"):
+            result = agent.handle(command, parameters)
+        failed = isinstance(result, dict) and "error" in result
+        return result
+    finally:
+        record_agent_request(
+            *metric_labels(agent, command), time.perf_counter() - started, failed
+        )
+
+
+def metric_labels(agent, command):
+    """指標標籤只使用已知的 agent 與命令，避免任意輸入產生無限多的時間序列"""
+    if agent is None:
+        return "unknown", "unknown"
+    return agent.agent_type, command if command in agent.commands else "unknown"
+
+
+async def run_blocking(func, *args):
+    """在執行緒池中執行阻塞函數，超過 REQUEST_TIMEOUT 秒返回 504"""
+    loop = asyncio.get_running_loop()
+    # 帶上目前的 context，讓執行緒中的 span 記錄到同一個請求
+    context = contextvars.copy_context()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, partial(context.run, func, *args)),
+            REQUEST_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Request timed out")
+
+
+async def resolve_request(body):
+    """將請求主體轉為結構化請求；自然語言輸入會先經過解析"""
+    natural_language = body.get("natural_language", False)
+    user_input = body.get("query")
+
+    if not (natural_language and user_input):
+        # 若為結構化請求，直接使用
+        return body
+
+    # 使用自然語言解析
+    structured_request = await run_blocking(parse_user_input_to_api_request, user_input)
+    if "error" in structured_request:
+        raise HTTPException(status_code=400, detail=structured_request["error"])
+    if "llm_reply" in body and structured_request["agent_type"] == "weather":
+        structured_request["parameters"]["llm_reply"] = body["llm_reply"]
+    return structured_request
+
+
 @app.post("/api/life-assistant")
 async def unified_agent(request: Request):
     try:
         body = await request.json()
-        natural_language = body.get("natural_language", False)
-        user_input = body.get("query")
-
-        if natural_language and user_input:
-            # 使用自然語言解析
-            structured_request = parse_user_input_to_api_request(user_input)
-            if "error" in structured_request:
-                raise HTTPException(status_code=400, detail=structured_request["error"])
-        else:
-            # 若為結構化請求，直接使用
-            structured_request = body
+        structured_request = await resolve_request(body)
+
+        if (
+            body.get("stream")
+            and structured_request.get("agent_type") == "calendar"
+            and structured_request.get("command") == "query"
+        ):
+            # 以 NDJSON 逐筆串流事件，取得一頁就先送出
+            calendar = await run_blocking(agent_registry.load, "calendar")
+            return StreamingResponse(
+                calendar.stream_events(structured_request.get("parameters", {})),
+                media_type="application/x-ndjson",
+            )
+
+        return await run_blocking(dispatch_request, structured_request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {e}")
+
 
-        agent_type = structured_request.get("agent_type")
-        command = structured_request.get("command")
+def sse_event(event, data):
+    """格式化一則 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_stream(structured_request, result, tokens=None):
+    """先送出結構化結果，再逐段送出 LLM 回覆，最後以 done 結束"""
+    yield sse_event(
+        "result",
+        {
+            "agent_type": structured_request.get("agent_type"),
+            "command": structured_request.get("command"),
+            "result": result,
+        },
+    )
+    if tokens is not None:
+        try:
+            for token in tokens:
+                if token:
+                    yield sse_event("token", {"text": token})
+        except Exception as e:
+            yield sse_event("error", {"error": f"LLM 回覆產生失敗: {e}"})
+    yield sse_event("done", {})
+
+
+@app.post("/api/life-assistant/stream")
+async def unified_agent_stream(request: Request):
+    """以 SSE 回應：結構化結果一取得就送出，天氣回覆則逐段串流 LLM 產生的文字"""
+    try:
+        body = await request.json()
+        structured_request = await resolve_request(body)
         parameters = structured_request.get("parameters", {})
 
-        if agent_type == "accounting":
-            return handle_accounting(command, parameters)
-        elif agent_type == "calendar":
-            return handle_command_calendar(command, parameters)
-        elif agent_type == "weather":
-            return handle_weather_request(parameters)
+        if structured_request.get("agent_type") == "weather":
+            weather = await run_blocking(agent_registry.load, "weather")
+            weather_data = await run_blocking(weather.prepare_weather_data, parameters)
+            if "error" in weather_data:
+                tokens = None
+            elif not parameters.get("llm_reply", weather.WEATHER_LLM_REPLY):
+                # 不使用 LLM 時（預設依 WEATHER_LLM_REPLY），以本地範本的回覆作為唯一一段文字
+                tokens = [render_weather_reply(weather_data)]
+            else:
+                query = parameters.get("query") or weather_data["location"]
+                tokens = weather.stream_weather_response(query, weather_data)
+            events = sse_stream(structured_request, weather_data, tokens)
         else:
-            raise HTTPException(status_code=400, detail="Unknown agent type")
+            result = await run_blocking(dispatch_request, structured_request)
+            events = sse_stream(structured_request, result)
+
+        return StreamingResponse(events, media_type="text/event-stream")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {e}")
+
+
+async def run_batch_item(index, structured_request):
+    """執行批次中的一項，返回該項的狀態、耗時與結果"""
+    started = time.perf_counter()
+    item = {"index": index}
+    try:
+        if not isinstance(structured_request, dict):
+            raise HTTPException(status_code=400, detail="Request must be an object")
+        if "error" in structured_request:
+            # 解析階段已失敗
+            raise HTTPException(status_code=400, detail=structured_request["error"])
+        result = await run_blocking(dispatch_request, structured_request)
+        failed = isinstance(result, dict) and "error" in result
+        item.update(status="error" if failed else "ok", result=result)
+    except HTTPException as e:
+        item.update(status="error", status_code=e.status_code, error=e.detail)
+    except Exception as e:
+        item.update(status="error", status_code=500, error=f"Server error: {e}")
+    item["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return item
+
+
+@app.post("/api/life-assistant/batch")
+async def unified_agent_batch(request: Request):
+    """一次處理多個請求：自然語言輸入合併解析，各 agent 並行執行，結果依輸入順序返回"""
+    body = await request.json()
+    items = body.get("requests")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="requests must be a non-empty list")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {BATCH_MAX_ITEMS} requests per batch"
+        )
+
+    started = time.perf_counter()
+    structured_requests = list(items)
+    nl_indexes = [
+        i
+        for i, item in enumerate(items)
+        if isinstance(item, dict) and item.get("natural_language") and item.get("query")
+    ]
+    if nl_indexes:
+        parsed = await run_blocking(
+            parse_batch, [items[i]["query"] for i in nl_indexes]
+        )
+        for i, parsed_data in zip(nl_indexes, parsed):
+            if "llm_reply" in items[i] and parsed_data.get("agent_type") == "weather":
+                parsed_data["parameters"]["llm_reply"] = items[i]["llm_reply"]
+            structured_requests[i] = parsed_data
+    parse_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    # 各項在執行緒池中並行執行，外部服務的並行數仍受 backend_slot 限制
+    results = await asyncio.gather(
+        *(run_batch_item(i, req) for i, req in enumerate(structured_requests))
+    )
+    return {
+        "results": results,
+        "parse_ms": parse_ms,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """記錄每個請求的延遲；啟用 SERVER_TIMING 時附上各階段耗時"""
+    if not TRACING_ENABLED:
+        return await call_next(request)
+    trace, token = start_trace()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        if SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = trace.server_timing(
+                time.perf_counter() - started
+            )
+        return response
+    finally:
+        # 以路由樣板作為標籤，避免未知路徑造成大量時間序列
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        record_http_request(request.method, path, status, time.perf_counter() - started)
+        end_trace(token)
+
+
+def collect_stats():
+    """返回各子系統的統計數據"""
+    return {
+        "google_credentials": credential_manager.stats(),
+        "google_clients": pool_stats(),
+        "clients": clients.stats(),
+        "parse_cache": parse_cache.stats(),
+        "rule_parser": rule_parser.stats(),
+        "structured_output": structured_output_stats(),
+        "backends": backend_stats(),
+        "singleflight": singleflight_stats(),
+        "agents": agent_registry.stats(),
+        "module_loader": loader_stats(),
+        "warmup": warmup.stats(),
+        # 已載入 agent 的子系統，例如 ledger_mirror、calendar_events
+        **agent_registry.subsystem_stats(),
+    }
+
+
+@app.get("/healthz/live")
+async def liveness():
+    return {"status": "ok"}
+
+
+@app.get("/healthz/ready")
+async def readiness():
+    """預熱完成前返回 503，內容列出各預熱步驟的結果與耗時"""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+# 統計會取用各子系統的鎖，宣告為一般函數讓 FastAPI 在執行緒池中執行，不佔用事件迴圈
+@app.get("/api/stats")
+def stats():
+    """返回各子系統的統計數據"""
+    return collect_stats()
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus 格式的延遲直方圖、錯誤計數與子系統統計"""
+    return PlainTextResponse(
+        render_metrics(collect_stats()), media_type="text/plain; version=0.0.4"
+    )
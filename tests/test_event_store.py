@@ -0,0 +1,111 @@
+import random
+import threading
+
+from agents.calendar_agent.event_store import EventStore
+from agents.calendar_agent.interval_index import IntervalIndex
+
+
+def make_event(event_id, summary, start, end):
+    return {
+        "id": event_id,
+        "summary": summary,
+        "start": {"dateTime": start},
+        "end": {"dateTime": end},
+    }
+
+
+class SlowCalendar:
+    """events().list 的替身；block 為 True 時停在下載途中，讓測試在同步期間操作快取"""
+
+    def __init__(self, events):
+        self.events = events
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.block = False
+
+    def list_events(self, **params):
+        items = [dict(event) for event in self.events]
+        if self.block:
+            self.fetching.set()
+            self.release.wait(5)
+        return {"items": items, "nextSyncToken": "token"}
+
+
+LUNCH = make_event(
+    "1", "午餐", "2026-10-01T12:00:00+08:00", "2026-10-01T13:00:00+08:00"
+)
+DENTIST = make_event(
+    "2", "牙醫", "2026-10-01T15:00:00+08:00", "2026-10-01T16:00:00+08:00"
+)
+
+
+def test_query_and_write_are_not_blocked_by_sync():
+    calendar = SlowCalendar([LUNCH])
+    store = EventStore(calendar.list_events, sync_interval=0)
+    store.ensure_fresh()
+
+    calendar.block = True
+    thread = threading.Thread(target=store.incremental_sync)
+    thread.start()
+    calendar.fetching.wait(5)
+    done = []
+    worker = threading.Thread(
+        target=lambda: (
+            store.apply_upsert(DENTIST),
+            done.append(store.query("2026-10-01", "2026-10-02")),
+            done.append(store.stats()),
+        )
+    )
+    worker.start()
+    worker.join(1)
+    assert len(done) == 2, "query or write waited for the calendar sync"
+    calendar.release.set()
+    thread.join(5)
+
+    # 下載期間有寫入，下載結果不套用，自己寫入的事件仍在
+    assert [event["id"] for event in store.query("2026-10-01", "2026-10-02")] == [
+        "1",
+        "2",
+    ]
+    assert store.stats()["sync_conflicts"] == 1
+
+
+def test_interval_index_updates_match_rebuild():
+    rng = random.Random(7)
+    live = []
+    index = IntervalIndex([])
+    for _ in range(300):
+        if live and rng.random() < 0.4:
+            item = live.pop(rng.randrange(len(live)))
+            assert index.remove(*item)
+        else:
+            start = rng.randrange(0, 1000)
+            item = (start, start + rng.randrange(1, 100), object())
+            live.append(item)
+            index.add(*item)
+        lower = rng.randrange(0, 1000)
+        upper = lower + rng.randrange(1, 200)
+        expected = sorted(
+            (item for item in live if item[0] < upper and item[1] > lower),
+            key=lambda item: (item[0], item[1]),
+        )
+        found = index.overlapping(lower, upper)
+        # 開始與結束相同的項目之間順序不固定
+        assert [item[:2] for item in found] == [item[:2] for item in expected]
+        assert {id(item[2]) for item in found} == {id(item[2]) for item in expected}
+
+
+def test_upsert_moves_event_in_index():
+    calendar = SlowCalendar([LUNCH, DENTIST])
+    store = EventStore(calendar.list_events, sync_interval=3600)
+    store.ensure_fresh()
+    assert [e["id"] for e in store.at("2026-10-01T12:30:00+08:00")] == ["1"]
+
+    moved = make_event(
+        "1", "午餐", "2026-10-01T15:30:00+08:00", "2026-10-01T16:30:00+08:00"
+    )
+    store.apply_upsert(moved)
+    assert store.at("2026-10-01T12:30:00+08:00") == []
+    assert [e["id"] for e in store.at("2026-10-01T15:45:00+08:00")] == ["2", "1"]
+    store.apply_delete("2")
+    assert [e["id"] for e in store.at("2026-10-01T15:45:00+08:00")] == ["1"]
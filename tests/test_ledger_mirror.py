@@ -0,0 +1,104 @@
+import threading
+
+from agents.accounting_agent.ledger_mirror import LedgerMirror
+
+HEADER = ["日期", "分類", "金額", "描述"]
+
+
+class SlowSheet:
+    """讀取整張表時停在中途，讓測試在讀取期間寫入鏡像"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.block = False
+
+    def fetch(self):
+        rows = [list(row) for row in self.rows]
+        if self.block:
+            self.fetching.set()
+            self.release.wait(5)
+        return rows
+
+
+def test_write_during_reconcile_is_not_lost():
+    sheet = SlowSheet([HEADER, ["2026-10-01", "餐飲", "100", ""]])
+    mirror = LedgerMirror(sheet.fetch, reconcile_interval=0)
+    mirror.ensure_loaded()
+
+    sheet.block = True
+    thread = threading.Thread(target=mirror.reconcile)
+    thread.start()
+    sheet.fetching.wait(5)
+    # 讀取已開始後才寫入的列不在讀到的內容中
+    row = ["2026-10-02", "交通", "50", ""]
+    sheet.rows.append(row)
+    mirror.apply_append([row], "記帳!A3:D3")
+    sheet.release.set()
+    thread.join(5)
+
+    sheet.block = False
+    # 讀到的內容被丟棄，鏡像保留 write-through 的列（試算表讀回的格式）
+    assert mirror.query(date_range=["2026-10-02", "2026-10-02"]) == [
+        ["2026-10-02", "交通", "50"]
+    ]
+    assert mirror.stats()["reconcile_conflicts"] == 1
+
+
+def test_query_is_not_blocked_by_reconcile():
+    sheet = SlowSheet([HEADER, ["2026-10-01", "餐飲", "100", ""]])
+    mirror = LedgerMirror(sheet.fetch, reconcile_interval=0)
+    mirror.ensure_loaded()
+
+    sheet.block = True
+    thread = threading.Thread(target=mirror.reconcile)
+    thread.start()
+    sheet.fetching.wait(5)
+    result = []
+    reader = threading.Thread(target=lambda: result.append(mirror.query()))
+    reader.start()
+    reader.join(1)
+    assert result, "query waited for the sheet fetch"
+    sheet.release.set()
+    thread.join(5)
+
+
+def test_write_through_rows_match_reconciled_format():
+    sheet = SlowSheet([HEADER, ["2026-10-01", "餐飲", "100", "午餐"]])
+    mirror = LedgerMirror(sheet.fetch, reconcile_interval=0)
+    mirror.ensure_loaded()
+
+    mirror.apply_append([["2026-10-02", "交通", 999, ""]], "記帳!A3:D3")
+    mirror.apply_update(2, ["2026-10-01", "餐飲", 120.0, "午餐"])
+    before = mirror.query()
+
+    # 試算表讀回的都是字串，且不含結尾的空白儲存格
+    sheet.rows = [
+        HEADER,
+        ["2026-10-01", "餐飲", "120", "午餐"],
+        ["2026-10-02", "交通", "999"],
+    ]
+    mirror.reconcile()
+    assert before == mirror.query()
+    assert before[2] == ["2026-10-02", "交通", "999"]
+
+
+def test_conflicting_reconcile_backs_off():
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        # 每次讀取期間都有寫入，對帳一定衝突
+        mirror.apply_update(2, ["2026-10-01", "餐飲", "100", "午餐"])
+        return [HEADER, ["2026-10-01", "餐飲", "100", "午餐"]]
+
+    mirror = LedgerMirror(fetch, reconcile_interval=30)
+    mirror.replace([HEADER, ["2026-10-01", "餐飲", "100", ""]])
+    # 新增的列號接不上，鏡像需要重新對帳
+    mirror.apply_append([["2026-10-05", "交通", "50"]], "記帳!A5:D5")
+
+    for _ in range(5):
+        mirror.query()
+    assert len(fetches) == 1
+    assert mirror.stats()["reconcile_conflicts"] == 1
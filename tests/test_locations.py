@@ -0,0 +1,25 @@
+from agents.weather_agent.locations import SEED_LOCATIONS, LocationDirectory
+
+
+def make_directory():
+    translated = []
+
+    def translate(name):
+        translated.append(name)
+        return "Xinyi Township"
+
+    return LocationDirectory(translate, path=None), translated
+
+
+def test_suffix_of_same_level_resolves_to_seed():
+    directory, translated = make_directory()
+    assert directory.resolve("信義區") == SEED_LOCATIONS["信義"]
+    assert directory.resolve("臺北市") == SEED_LOCATIONS["台北"]
+    assert translated == []
+
+
+def test_suffix_of_other_level_is_translated():
+    directory, translated = make_directory()
+    # 南投的信義鄉不是台北的信義區
+    assert directory.resolve("信義鄉") == {"name": "Xinyi Township"}
+    assert translated == ["信義鄉"]
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+
+from agents.tools.parse_cache import TIMEZONE
+from agents.tools.rule_parser import RuleParser
+
+NOW = datetime(2026, 12, 30, 10, 0, tzinfo=TIMEZONE)
+
+
+@pytest.fixture
+def parser():
+    return RuleParser(locations=("台北", "高雄"))
+
+
+def parse(parser, text):
+    result, _, _ = parser.parse(text, now=NOW)
+    return result
+
+
+def test_delete_strips_leading_particle(parser):
+    result = parse(parser, "取消2030/5/1的牙醫行程")
+    assert result["command"] == "delete"
+    assert result["parameters"]["summary"] == "牙醫"
+    assert result["parameters"]["start_time"].startswith("2030-05-01")
+
+
+def test_delete_keeps_clean_summary(parser):
+    result = parse(parser, "取消明天的會議")
+    assert result["parameters"]["summary"] == "會議"
+    assert result["parameters"]["start_time"].startswith("2026-12-31")
+
+
+def test_delete_with_unclear_summary_falls_back(parser):
+    assert parse(parser, "取消明天跟小明的晚餐") is None
+
+
+def test_account_settings_is_not_accounting(parser):
+    assert parse(parser, "查詢帳號設定") is None
+
+
+def test_unfiltered_ledger_query_falls_back(parser):
+    assert parse(parser, "查詢記帳") is None
+
+
+def test_filtered_ledger_query(parser):
+    result = parse(parser, "查詢這個月的餐飲支出")
+    assert result["parameters"] == {
+        "date_range": ["2026-12-01", "2026-12-31"],
+        "category": "餐飲",
+    }
+
+
+def test_next_year_month_day(parser):
+    result = parse(parser, "明年1/1台北天氣")
+    assert result["parameters"]["datetime"] == "2027-01-01 12:00:00"
+
+
+def test_past_weather_date_falls_back(parser):
+    # 年底說「1/1」時年份不明確
+    assert parse(parser, "1/1台北天氣") is None
+
+
+def test_month_day_defaults_to_this_year(parser):
+    result = parse(parser, "查詢12/1的交通支出")
+    assert result["parameters"]["date_range"] == ["2026-12-01", "2026-12-01"]
+
+
+def test_weather_location_keeps_admin_suffix():
+    parser = RuleParser(locations=("信義", "台北"))
+    result, _, _ = parser.parse("明天信義鄉天氣", now=NOW)
+    assert result["parameters"]["location"] == "信義鄉"
+
+
+def test_tonight_and_this_morning_times(parser):
+    result = parse(parser, "今晚8點台北天氣")
+    assert result["parameters"]["datetime"] == "2026-12-30 20:00:00"
+    result = parse(parser, "今早9點台北天氣")
+    assert result["parameters"]["datetime"] == "2026-12-30 09:00:00"
+
+
+def test_tonight_midnight_falls_back(parser):
+    assert parse(parser, "今晚12點台北天氣") is None
+
+
+def test_question_does_not_mutate(parser):
+    assert parse(parser, "我明天中午12點要吃午餐花了200元嗎") is None
+    assert parse(parser, "午餐200元？") is None
+    assert parse(parser, "午餐200元")["command"] == "add"
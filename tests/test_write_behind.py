@@ -0,0 +1,124 @@
+import json
+
+from agents.accounting_agent.write_behind import WriteBehindQueue
+
+
+class BadRow(Exception):
+    """試算表拒絕這一列（相當於 400），重試也不會成功"""
+
+
+class FakeSheet:
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+
+    def append(self, rows):
+        self.calls += 1
+        if any(row[2] == "bad" for row in rows):
+            raise BadRow("invalid amount")
+        self.rows.extend(rows)
+
+
+def make_queue(tmp_path, sheet, **kwargs):
+    return WriteBehindQueue(
+        str(tmp_path / "journal.jsonl"),
+        sheet.append,
+        flush_interval=60,
+        max_batch=10,
+        dead_letter_path=str(tmp_path / "dead.jsonl"),
+        retryable=lambda error: not isinstance(error, BadRow),
+        **kwargs,
+    )
+
+
+def crash(queue):
+    # 模擬程序中止：不送出、不寫 flushed 標記，只放掉檔案與執行緒
+    queue._stopping = True
+    with queue._cond:
+        queue._cond.notify_all()
+    queue._thread.join(5)
+    queue._journal.close()
+
+
+def test_unflushed_entries_are_replayed_after_crash(tmp_path):
+    sheet = FakeSheet()
+    queue = make_queue(tmp_path, sheet)
+    queue.submit(["2026-10-01", "餐飲", "100", ""])
+    queue.flush_now()
+    queue.submit(["2026-10-02", "交通", "50", ""])
+    queue.submit(["2026-10-03", "餐飲", "80", ""])
+    crash(queue)
+
+    restarted = make_queue(tmp_path, sheet)
+    restarted.start()
+    assert restarted.stats()["replayed"] == 2
+    restarted.flush_now()
+    restarted.stop()
+    assert [row[0] for row in sheet.rows] == ["2026-10-01", "2026-10-02", "2026-10-03"]
+
+    # 新條目的序號接在重放的條目之後
+    again = make_queue(tmp_path, sheet)
+    assert again.submit(["2026-10-04", "餐飲", "60", ""]) == 4
+    again.stop(flush=False)
+
+
+def test_poison_row_is_isolated_and_dead_lettered(tmp_path):
+    sheet = FakeSheet()
+    queue = make_queue(tmp_path, sheet, max_attempts=2)
+    queue.submit(["2026-10-01", "餐飲", "100", ""])
+    queue.submit(["2026-10-02", "交通", "bad", ""])
+    queue.submit(["2026-10-03", "餐飲", "80", ""])
+
+    failures = 0
+    for _ in range(10):
+        try:
+            queue.flush_now()
+            break
+        except BadRow:
+            failures += 1
+    assert failures == 1
+    assert [row[0] for row in sheet.rows] == ["2026-10-01", "2026-10-03"]
+    assert queue.stats()["dead_lettered"] == 1
+    assert queue.pending_count() == 0
+
+    with open(tmp_path / "dead.jsonl", encoding="utf-8") as dead:
+        records = [json.loads(line) for line in dead]
+    assert [record["row"][2] for record in records] == ["bad"]
+    queue.stop()
+
+    # 死信不會在重啟時重放
+    restarted = make_queue(tmp_path, sheet)
+    restarted.start()
+    assert restarted.pending_count() == 0
+    restarted.stop()
+
+
+def test_retryable_errors_are_not_dead_lettered(tmp_path):
+    sheet = FakeSheet()
+    outage = [True]
+
+    def append(rows):
+        if outage[0]:
+            raise ConnectionError("sheets unavailable")
+        sheet.append(rows)
+
+    queue = WriteBehindQueue(
+        str(tmp_path / "journal.jsonl"),
+        append,
+        flush_interval=60,
+        max_batch=10,
+        dead_letter_path=str(tmp_path / "dead.jsonl"),
+        max_attempts=1,
+    )
+    queue.submit(["2026-10-01", "餐飲", "100", ""])
+    for _ in range(3):
+        try:
+            queue.flush_now()
+        except ConnectionError:
+            pass
+    assert queue.pending_count() == 1
+    outage[0] = False
+    queue.flush_now()
+    queue.stop()
+    assert queue.stats()["dead_lettered"] == 0
+    assert len(sheet.rows) == 1
@@ -1,6 +1,65 @@
 import os
 import ast
+import hashlib
 import importlib.util
+import sys
+import threading
+import time
+
+# 已載入的模組與函數清單，依 (修改時間, 檔案大小) 判斷是否需要重新載入
+_modules = {}  # 絕對路徑 -> (mtime_ns, size, 模組)
+_functions = {}  # 絕對路徑 -> (mtime_ns, size, [函數名稱])
+_lock = threading.RLock()
+_stats = {'loads': 0, 'reloads': 0, 'hits': 0, 'load_seconds': 0.0, 'parses': 0, 'parse_hits': 0}
+_load_times = {}  # 絕對路徑 -> {'loads': 次數, 'last_load_seconds': 秒數}
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _unique_module_name(path):
+    # 以路徑雜湊區分不同目錄中的同名檔案，避免互相覆蓋 sys.modules
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:10]
+    return f'_dynamic_{module_name}_{digest}'
+
+
+def load_module(file_path):
+    """載入並快取模組；檔案未變更時直接返回上次載入的模組"""
+    path = os.path.abspath(file_path)
+    signature = _signature(path)
+    with _lock:
+        cached = _modules.get(path)
+        if cached is not None and cached[:2] == signature:
+            _stats['hits'] += 1
+            return cached[2]
+
+        started = time.perf_counter()
+        name = _unique_module_name(path)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            # 載入失敗時保留上一個可用的版本
+            if cached is not None:
+                sys.modules[name] = cached[2]
+            else:
+                sys.modules.pop(name, None)
+            raise
+        elapsed = time.perf_counter() - started
+
+        _modules[path] = (signature[0], signature[1], module)
+        _stats['reloads' if cached is not None else 'loads'] += 1
+        _stats['load_seconds'] += elapsed
+        entry = _load_times.setdefault(path, {'loads': 0, 'last_load_seconds': 0.0})
+        entry['loads'] += 1
+        entry['last_load_seconds'] = elapsed
+        return module
+
 
 def import_modules_from_directory(directory):
     modules = {}
@@ -8,20 +67,28 @@ def import_modules_from_directory(directory):
         if filename.endswith('.py'):
             module_name = os.path.splitext(filename)[0]
             module_path = os.path.join(directory, filename)
-            spec = importlib.util.spec_from_file_location(module_name, module_path)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            modules[module_name] = module
+            modules[module_name] = load_module(module_path)
 
     return modules
 
 def get_function_names_from_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
+    path = os.path.abspath(file_path)
+    signature = _signature(path)
+    with _lock:
+        cached = _functions.get(path)
+        if cached is not None and cached[:2] == signature:
+            _stats['parse_hits'] += 1
+            return list(cached[2])
+
+    with open(path, 'r', encoding='utf-8') as file:
         file_content = file.read()
 
     tree = ast.parse(file_content)
     functions = [node.name for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)]
-    return functions
+    with _lock:
+        _functions[path] = (signature[0], signature[1], functions)
+        _stats['parses'] += 1
+    return list(functions)
 
 def get_functions_from_files(directory):
     all_functions = {}
@@ -34,7 +101,24 @@ def get_functions_from_files(directory):
     return all_functions
 
 def import_function_from_file(file_path, function_name):
-    spec = importlib.util.spec_from_file_location("module.name", file_path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return getattr(module, function_name)
\ No newline at end of file
+    module = load_module(file_path)
+    return getattr(module, function_name)
+
+
+def loader_stats(per_file=False):
+    """返回載入次數、快取命中與總載入耗時；per_file 為 True 時附上各檔案的載入耗時"""
+    with _lock:
+        stats = dict(_stats)
+        stats['cached_modules'] = len(_modules)
+        stats['cached_inventories'] = len(_functions)
+        if per_file:
+            stats['files'] = {path: dict(entry) for path, entry in _load_times.items()}
+    return stats
+
+
+def clear_cache():
+    with _lock:
+        for path, (_, _, module) in _modules.items():
+            sys.modules.pop(module.__name__, None)
+        _modules.clear()
+        _functions.clear()